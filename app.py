@@ -11,13 +11,13 @@ import shutil
 from datetime import datetime
 from pathlib import Path
 from textwrap import dedent
-from base64 import b64encode
+from urllib.parse import quote
 
 import streamlit as st
 import streamlit.components.v1 as components
 
-from rag_pipeline import make_chain, get_index_stats
-from build_index import build_index  # pour l’indexation automatique
+# Les modules lourds (rag_pipeline → langchain / chromadb, build_index →
+# chargeurs PDF/DOCX) sont importés à la demande pour accélérer le démarrage.
 
 # ==========================================================
 # CONFIG GÉNÉRALE
@@ -35,6 +35,8 @@ BOT_NAME = "LamBot"
 HISTORY_PATH = Path("chat_history.json")   # ancien format (migration)
 SESSIONS_PATH = Path("chat_sessions.json") # nouveau format (multi-sessions)
 SETTINGS_PATH = Path("chat_settings.json")  # au cas où pour le futur
+# PDFs publiés via le serveur statique de Streamlit (server.enableStaticServing)
+STATIC_PDF_DIR = Path("static") / "pdfs"
 
 
 # ==========================================================
@@ -138,6 +140,34 @@ def get_current_session():
     return st.session_state.sessions_data["sessions"][0]
 
 
+def bump_revision(sess):
+    """Révision de la session, incrémentée à chaque modification (cache des exports)."""
+    sess["revision"] = sess.get("revision", 0) + 1
+
+
+def get_search_index():
+    """
+    Index plein texte de toutes les conversations (voir chat_search.py),
+    construit une seule fois puis mis à jour à chaque modification.
+    """
+    if "search_index" not in st.session_state:
+        from chat_search import ChatSearchIndex
+        st.session_state.search_index = ChatSearchIndex.from_sessions(
+            st.session_state.sessions_data["sessions"]
+        )
+    return st.session_state.search_index
+
+
+def next_session_id() -> str:
+    """Identifiant unique (même après suppression de conversations)."""
+    nums = [
+        int(s["id"].rsplit("-", 1)[-1])
+        for s in st.session_state.sessions_data["sessions"]
+        if s["id"].rsplit("-", 1)[-1].isdigit()
+    ]
+    return f"session-{max(nums, default=0) + 1}"
+
+
 def switch_session(new_id: str):
     st.session_state.current_session_id = new_id
     sess = get_current_session()
@@ -148,7 +178,7 @@ def switch_session(new_id: str):
 
 def create_new_session(name: str | None = None):
     sessions = st.session_state.sessions_data["sessions"]
-    new_id = f"session-{len(sessions) + 1}"
+    new_id = next_session_id()
     new_name = name or f"Conversation {len(sessions) + 1}"
     new_sess = {
         "id": new_id,
@@ -157,6 +187,9 @@ def create_new_session(name: str | None = None):
         "last_used": iso_now(),
         "history": [],
     }
+    # La nouvelle conversation interroge le même corpus que la conversation active
+    if "corpus" in get_current_session():
+        new_sess["corpus"] = get_current_session()["corpus"]
     sessions.append(new_sess)
     switch_session(new_id)
 
@@ -168,6 +201,7 @@ def delete_current_session():
         return
 
     cur_id = st.session_state.current_session_id
+    get_search_index().remove_session(cur_id)
     sessions = [s for s in sessions if s["id"] != cur_id]
     st.session_state.sessions_data["sessions"] = sessions
     # on prend la première comme nouvelle session courante
@@ -176,10 +210,20 @@ def delete_current_session():
     save_sessions()
 
 
+def set_session_corpus(name: str):
+    """Associe la conversation active à un corpus (filtre de documents remis à zéro)."""
+    sess = get_current_session()
+    if sess.get("corpus", "default") == name:
+        return
+    sess["corpus"] = name
+    sess["sources_filter"] = []
+    save_sessions()
+
+
 # ==========================================================
 # HISTORIQUE (messages) — basé sur la session courante
 # ==========================================================
-def append_message(role, content, when=None):
+def append_message(role, content, when=None, sources=None):
     sess = get_current_session()
     msg = {
         "role": role,
@@ -187,16 +231,22 @@ def append_message(role, content, when=None):
         "time": when or now_time_str(),
         "date": today_str(),
     }
+    if sources:
+        msg["sources"] = sources
     sess["history"].append(msg)
     sess["last_used"] = iso_now()
+    bump_revision(sess)
     st.session_state.chat_history = sess["history"]
+    get_search_index().add_message(sess["id"], len(sess["history"]) - 1, msg)
     save_sessions()
 
 
 def clear_current_history():
     sess = get_current_session()
     sess["history"] = []
+    bump_revision(sess)
     st.session_state.chat_history = []
+    get_search_index().remove_session(sess["id"])
     save_sessions()
 
 
@@ -209,7 +259,11 @@ def delete_last_exchange():
     if len(hist) < 2:
         return
     # On enlève les deux derniers messages
+    index = get_search_index()
+    for i in (len(hist) - 2, len(hist) - 1):
+        index.remove_message(sess["id"], i)
     sess["history"] = hist[:-2]
+    bump_revision(sess)
     st.session_state.chat_history = sess["history"]
     save_sessions()
 
@@ -219,9 +273,12 @@ def pin_last_answer():
     Marque la dernière réponse de LamBot comme 'pinned'.
     """
     sess = get_current_session()
-    for msg in reversed(sess["history"]):
+    for i in range(len(sess["history"]) - 1, -1, -1):
+        msg = sess["history"][i]
         if msg.get("role") == "assistant":
             msg["pinned"] = True
+            bump_revision(sess)
+            get_search_index().set_pinned(sess["id"], i)
             break
     save_sessions()
 
@@ -371,13 +428,45 @@ if "ask_confirm_history" not in st.session_state:
 if "ask_confirm_full_reset" not in st.session_state:
     st.session_state.ask_confirm_full_reset = False
 
-# Chaîne RAG
-if "chain" not in st.session_state:
-    try:
-        st.session_state.chain = make_chain()
-        st.success("Chaîne RAG initialisée 🎉")
-    except Exception as e:
-        st.error(f"Erreur : {e}")
+# Chaînes RAG : une par corpus, construites en arrière-plan à la première
+# utilisation (sans bloquer l'affichage) et fermées quand elles restent
+# inactives (voir corpora.CorpusPool).
+def _build_chain(db_dir: str):
+    from rag_pipeline import make_chain
+    return make_chain(db_dir=db_dir, with_sources=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_corpus_pool():
+    from corpora import CorpusPool
+    return CorpusPool(_build_chain)
+
+
+def current_corpus() -> dict:
+    """Corpus (dossiers data / index) de la conversation active."""
+    from corpora import DEFAULT_CORPUS, get_corpus
+    return get_corpus(get_current_session().get("corpus", DEFAULT_CORPUS))
+
+
+def lease_chain():
+    """
+    Chaîne RAG du corpus actif (attend la fin de sa construction si besoin),
+    à utiliser dans un bloc with : le corpus n'est pas fermé pendant la requête.
+    """
+    return get_corpus_pool().lease(current_corpus()["name"])
+
+
+corpus_pool = get_corpus_pool()
+corpus_pool.prefetch(current_corpus()["name"])
+chain_status = corpus_pool.status(current_corpus()["name"])
+if chain_status == "building":
+    st.info("⏳ Chaîne RAG en cours d’initialisation (arrière-plan)…")
+elif chain_status == "error":
+    st.error(f"Erreur : {corpus_pool.error(current_corpus()['name'])}")
+    corpus_pool.drop(current_corpus()["name"])
+elif not st.session_state.get("chain_ready_shown"):
+    st.success("Chaîne RAG initialisée 🎉")
+    st.session_state.chain_ready_shown = True
 
 
 # ==========================================================
@@ -415,22 +504,118 @@ new_name = st.text_input("Renommer la conversation", value=current_sess["name"])
 if new_name.strip() and new_name != current_sess["name"]:
     if st.button("✅ Appliquer le nouveau nom"):
         current_sess["name"] = new_name.strip()
+        bump_revision(current_sess)
         save_sessions()
         st.experimental_rerun()
 
+# Corpus interrogé par cette conversation (documents + index isolés)
+from corpora import create_corpus, list_corpora
+
+col_c1, col_c2 = st.columns([2, 1])
+with col_c1:
+    corpus_names = list_corpora()
+    active_corpus = current_corpus()["name"]
+    chosen_corpus = st.selectbox(
+        "📚 Corpus interrogé",
+        corpus_names,
+        index=corpus_names.index(active_corpus),
+        key=f"corpus_select_{current_sess['id']}",
+    )
+    if chosen_corpus != active_corpus:
+        set_session_corpus(chosen_corpus)
+        st.rerun()
+with col_c2:
+    new_corpus = st.text_input("Nouveau corpus", placeholder="ex : juridique")
+    if st.button("➕ Créer le corpus") and new_corpus.strip():
+        try:
+            created = create_corpus(new_corpus)
+            set_session_corpus(created["name"])
+            st.rerun()
+        except ValueError as e:
+            st.warning(str(e))
+
 
 # ==========================================================
 # STATS CHROMA
 # ==========================================================
-if os.path.exists("chroma"):
-    try:
-        stats = get_index_stats()
-        st.info(f"📊 {stats['collections']} collections — {stats['chunks']} chunks indexés")
-    except Exception:
-        st.warning("Impossible de lire les statistiques.")
+@st.cache_data(show_spinner=False)
+def cached_index_stats(db_dir: str, mtime: float):
+    """Statistiques d'index, recalculées seulement si l'index a changé."""
+    from rag_pipeline import get_index_stats
+    # Index protégé de l'éviction du pool pendant la lecture
+    with get_corpus_pool().hold(db_dir):
+        return get_index_stats(db_dir)
+
+
+def index_mtime(db_dir: str) -> float:
+    sqlite = Path(db_dir) / "chroma.sqlite3"
+    return sqlite.stat().st_mtime if sqlite.exists() else os.path.getmtime(db_dir)
+
+
+corpus = current_corpus()
+if os.path.exists(corpus["db_dir"]):
+    if chain_status == "building":
+        # chromadb est encore en cours d'import par la construction de la chaîne
+        st.info("📊 Statistiques de l’index disponibles dès que la chaîne est prête.")
+    else:
+        try:
+            stats = cached_index_stats(corpus["db_dir"], index_mtime(corpus["db_dir"]))
+            st.info(
+                f"📊 Corpus « {corpus['name']} » : {stats['collections']} collections "
+                f"— {stats['chunks']} chunks indexés — {stats.get('documents', 0)} documents"
+            )
+        except Exception:
+            st.warning("Impossible de lire les statistiques.")
 else:
     st.warning("Aucun index Chroma trouvé. Ajoute des fichiers pour créer un index.")
 
+def profiling_requested() -> bool:
+    """Profilage demandé dans cette session (case à cocher de l'instrumentation)."""
+    import profiling
+    return st.session_state.get("profiling_enabled", profiling.is_enabled())
+
+
+# Instrumentation : routage LLM + préchauffage (latence à froid / à chaud)
+with st.expander("⏱️ Instrumentation des modèles", expanded=False):
+    from model_router import peek_router
+    from model_warmup import WARMUP_REPORT
+
+    st.markdown("**Routage LLM** (tokens/s observés, requêtes en cours)")
+    # Pas de get_router() ici : sa création (health-check bloquant) reste
+    # dans la construction de la chaîne, en arrière-plan
+    router = peek_router()
+    if router is not None:
+        st.table(router.snapshot())
+    else:
+        st.caption("Routeur pas encore initialisé (chaîne RAG en cours de construction).")
+    st.caption(
+        f"Corpus ouverts : {', '.join(corpus_pool.active()) or 'aucun'} "
+        f"(max {corpus_pool.max_active}, fermés après {int(corpus_pool.idle_ttl)} s d’inactivité)"
+    )
+    st.markdown(f"**Préchauffage** : {WARMUP_REPORT['status']}")
+    rows = [
+        {"modèle": name, **entry} for name, entry in WARMUP_REPORT["models"].items()
+    ]
+    if rows:
+        st.table(rows)
+    st.caption("Journal détaillé des décisions : logs/routing.jsonl")
+
+    # Profilage à la demande (cProfile + tracemalloc), voir profiling.py
+    import profiling
+
+    # Réglage propre à la session (passé à profile_run), pas au processus :
+    # deux onglets ouverts ne s'activent / désactivent pas mutuellement
+    st.checkbox("🧪 Profiler les questions et l’indexation (cProfile + tracemalloc)",
+                value=profiling.is_enabled(), key="profiling_enabled")
+    recent_runs = profiling.latest_runs()
+    if recent_runs:
+        st.table([
+            {"exécution": r["run"], "durée (s)": r["wall_s"], "pic (Mo)": r["peak_mb"],
+             "étapes": ", ".join(f"{s['stage']} {s['wall_s']:.2f}s" for s in r["stages"])}
+            for r in recent_runs
+        ])
+        st.caption(f"Rapports détaillés : {profiling.PROFILE_DIR}/<exécution>/summary.txt")
+
 
 # ==========================================================
 # UPLOAD, INDEX AUTOMATIQUE & LECTURE PDF
@@ -442,15 +627,20 @@ uploaded = st.file_uploader(
     type=["pdf", "txt", "md", "docx"],
 )
 if uploaded:
-    Path("data").mkdir(exist_ok=True)
-    dest = Path("data") / uploaded.name
+    Path(corpus["data_dir"]).mkdir(parents=True, exist_ok=True)
+    dest = Path(corpus["data_dir"]) / uploaded.name
     dest.write_bytes(uploaded.getbuffer())
-    st.success(f"{uploaded.name} ajouté dans ./data")
+    st.success(f"{uploaded.name} ajouté dans ./{corpus['data_dir']}")
 
     # 🔁 Indexation automatique
     with st.spinner("Mise à jour de l’index (automatique)…"):
         try:
-            build_index()
+            import profiling
+            from build_index import build_index
+            # Index protégé de l'éviction du pool pendant la construction
+            with corpus_pool.hold(corpus["db_dir"]):
+                with profiling.profile_run("build_index", enabled=profiling_requested()):
+                    build_index(data_dir=corpus["data_dir"], persist_dir=corpus["db_dir"])
             st.success("Index mis à jour ✅")
         except Exception as e:
             st.error(f"Erreur lors de l’indexation automatique : {e}")
@@ -461,7 +651,11 @@ with c1:
     if st.button("🔁 Reconstruire index manuellement"):
         with st.spinner("Reconstruction de l’index…"):
             try:
-                build_index()
+                import profiling
+                from build_index import build_index
+                with corpus_pool.hold(corpus["db_dir"]):
+                    with profiling.profile_run("build_index", enabled=profiling_requested()):
+                        build_index(data_dir=corpus["data_dir"], persist_dir=corpus["db_dir"])
                 st.success("Index reconstruit ✅")
             except Exception as e:
                 st.error(f"Erreur : {e}")
@@ -489,25 +683,145 @@ if st.session_state.ask_confirm_history:
             st.session_state.ask_confirm_history = False
 
 # 📖 LECTURE DES PDF
-st.subheader("📖 Lecture des PDFs (data/)")
-pdf_dir = Path("data")
+def publish_pdf(pdf_path: Path) -> str:
+    """
+    Rend un PDF d'un corpus accessible via le serveur statique de Streamlit
+    (lien physique, ou copie si impossible) et retourne son URL relative.
+    Le navigateur charge alors le fichier à la demande (requêtes Range,
+    cache HTTP) au lieu de recevoir tout le PDF en base64 à chaque rerun.
+    """
+    # Même arborescence que le dossier data du corpus (distinct pour chaque
+    # corpus, voir corpora.create_corpus) : pas de collision entre homonymes
+    rel_dir = pdf_path.parent
+    if rel_dir.is_absolute():
+        rel_dir = Path(rel_dir.name)
+    static_dir = STATIC_PDF_DIR / rel_dir
+    static_dir.mkdir(parents=True, exist_ok=True)
+    dest = static_dir / pdf_path.name
+    src_stat = pdf_path.stat()
+    if dest.exists():
+        dst_stat = dest.stat()
+        up_to_date = os.path.samefile(pdf_path, dest) or (
+            dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime >= src_stat.st_mtime
+        )
+        if not up_to_date:
+            dest.unlink()
+    if not dest.exists():
+        try:
+            os.link(pdf_path, dest)
+        except OSError:
+            shutil.copy2(pdf_path, dest)
+    return f"./app/static/pdfs/{quote(rel_dir.as_posix())}/{quote(pdf_path.name)}"
+
+
+def open_pdf_at(name: str, page: int):
+    """Callback : ouvre le viewer sur un PDF et une page (1-indexée)."""
+    st.session_state.pdf_select = Path(current_corpus()["data_dir"]) / name
+    st.session_state.pdf_page = max(1, page)
+    st.session_state.show_pdf = True
+
+
+st.subheader(f"📖 Lecture des PDFs ({corpus['data_dir']}/)")
+pdf_dir = Path(corpus["data_dir"])
 if pdf_dir.exists():
     pdf_files = sorted([p for p in pdf_dir.glob("*.pdf")])
     if pdf_files:
+        # Sources citées par la dernière réponse : accès direct à la page
+        last_sources = next(
+            (m.get("sources") for m in reversed(st.session_state.chat_history)
+             if m.get("role") == "assistant"),
+            None,
+        ) or []
+        cited = []
+        for src in last_sources:
+            path = Path(src.get("source", ""))
+            if path.suffix.lower() == ".pdf" and (pdf_dir / path.name) in pdf_files:
+                page = int(src.get("page") or 0) + 1
+                if (path.name, page) not in cited:
+                    cited.append((path.name, page))
+        if cited:
+            st.caption("🔗 Pages citées dans la dernière réponse :")
+            cols = st.columns(min(len(cited), 3))
+            for i, (name, page) in enumerate(cited):
+                cols[i % len(cols)].button(
+                    f"📄 {name} — p.{page}", key=f"cite_{i}",
+                    on_click=open_pdf_at, args=(name, page),
+                )
+
+        if st.session_state.get("pdf_select") not in pdf_files:
+            st.session_state.pdf_select = pdf_files[0]
         pdf_selected = st.selectbox(
             "Choisir un PDF à lire",
             pdf_files,
             format_func=lambda p: p.name,
+            key="pdf_select",
         )
-        with open(pdf_selected, "rb") as f:
-            pdf_bytes = f.read()
-        b64 = b64encode(pdf_bytes).decode("utf-8")
-        pdf_display = f'<iframe src="data:application/pdf;base64,{b64}" width="100%" height="600" type="application/pdf"></iframe>'
-        st.markdown(pdf_display, unsafe_allow_html=True)
+        if "pdf_page" not in st.session_state:
+            st.session_state.pdf_page = 1
+        page = st.number_input("Page", min_value=1, step=1, key="pdf_page")
+        if st.checkbox("Afficher le PDF", key="show_pdf"):
+            url = publish_pdf(pdf_selected)
+            st.markdown(
+                f'<iframe src="{url}#page={int(page)}" width="100%" height="600" '
+                f'type="application/pdf"></iframe>',
+                unsafe_allow_html=True,
+            )
+            st.caption(f"[Ouvrir dans un nouvel onglet]({url}#page={int(page)})")
     else:
-        st.info("Aucun PDF trouvé dans ./data pour le moment.")
+        st.info(f"Aucun PDF trouvé dans ./{corpus['data_dir']} pour le moment.")
 else:
-    st.info("Le répertoire ./data n’existe pas encore.")
+    st.info(f"Le répertoire ./{corpus['data_dir']} n’existe pas encore.")
+
+
+# ==========================================================
+# RECHERCHE DANS TOUTES LES CONVERSATIONS
+# ==========================================================
+st.subheader("🔎 Rechercher dans les conversations")
+
+search_q = st.text_input("Mots-clés", key="search_query", placeholder="Ex : réseaux de neurones")
+cf1, cf2, cf3 = st.columns(3)
+with cf1:
+    role_label = st.selectbox("Auteur", ["Tous", APP_USER_NAME, BOT_NAME], key="search_role")
+with cf2:
+    search_pinned = st.checkbox("Épinglés uniquement", key="search_pinned")
+with cf3:
+    search_current = st.checkbox("Conversation courante", key="search_current")
+date_range = ()
+if st.checkbox("Filtrer par dates", key="search_by_date"):
+    date_range = st.date_input("Période", value=(datetime.now(), datetime.now()), key="search_dates")
+
+def open_session_from_search(session_id: str):
+    """Callback : bascule sur la conversation d'un résultat de recherche."""
+    switch_session(session_id)
+    ids_now = [s["id"] for s in st.session_state.sessions_data["sessions"]]
+    # Garde le sélecteur de conversation synchronisé
+    st.session_state.session_select = ids_now.index(session_id)
+
+
+if search_q.strip():
+    role_filter = {"Tous": None, APP_USER_NAME: "user", BOT_NAME: "assistant"}[role_label]
+    t0 = time.perf_counter()
+    hits = get_search_index().search(
+        search_q,
+        session_id=st.session_state.current_session_id if search_current else None,
+        role=role_filter,
+        date_from=date_range[0].isoformat() if len(date_range) > 0 else None,
+        date_to=date_range[-1].isoformat() if len(date_range) > 0 else None,
+        pinned_only=search_pinned,
+    )
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    st.caption(f"{len(hits)} résultat(s) en {elapsed_ms:.1f} ms")
+    names = {s["id"]: s["name"] for s in st.session_state.sessions_data["sessions"]}
+    for n, hit in enumerate(hits):
+        speaker = APP_USER_NAME if hit["role"] == "user" else BOT_NAME
+        st.markdown(
+            f"**{html.escape(names.get(hit['session_id'], hit['session_id']))}** — "
+            f"{speaker} ({hit['time']} — {hit['date']})<br>{hit['snippet']}",
+            unsafe_allow_html=True,
+        )
+        if hit["session_id"] != st.session_state.current_session_id:
+            st.button("↪️ Ouvrir cette conversation", key=f"open_hit_{n}",
+                      on_click=open_session_from_search, args=(hit["session_id"],))
 
 
 # ==========================================================
@@ -518,42 +832,62 @@ st.subheader("🧰 Outils conversation")
 cur_session = get_current_session()
 cur_history = cur_session["history"]
 
-# --- Export Markdown ---
-def history_to_markdown(session):
-    lines = [
-        f"# Conversation — {session['name']}",
-        "",
-        f"Créée le : {session['created_at']}",
-        f"Dernière activité : {session['last_used']}",
-        "",
-    ]
-    for msg in session["history"]:
-        speaker = APP_USER_NAME if msg["role"] == "user" else BOT_NAME
-        lines.append(
-            f"**{speaker} ({msg.get('time','')} — {msg.get('date','')})**"
-        )
-        lines.append("")
-        lines.append(msg.get("content", ""))
-        lines.append("")
-    return "\n".join(lines)
-
-
-md_data = history_to_markdown(cur_session)
-st.download_button(
-    "📥 Télécharger la conversation en .md",
-    data=md_data,
-    file_name=f"conversation_{cur_session['name'].replace(' ', '_')}.md",
-    mime="text/markdown",
-)
-
-# --- Export JSON (pour ré-import) ---
-json_data = json.dumps(cur_history, ensure_ascii=False, indent=2)
-st.download_button(
-    "⬇️ Export JSON (pour ré-importer plus tard)",
-    data=json_data,
-    file_name=f"conversation_{cur_session['name'].replace(' ', '_')}.json",
-    mime="application/json",
+# --- Exports (Markdown / JSON / archive) : générés uniquement à la demande ---
+def session_version(session):
+    return (session.get("revision", 0), session["name"], session["last_used"])
+
+
+def cached_export(session, fmt):
+    """Export d'une session, regénéré seulement quand la session a changé."""
+    cache = st.session_state.setdefault("export_cache", {})
+    key = (session["id"], fmt)
+    version = session_version(session)
+    hit = cache.get(key)
+    if hit is None or hit[0] != version:
+        from exports import session_export
+        hit = (version, session_export(session, fmt, APP_USER_NAME, BOT_NAME))
+        cache[key] = hit
+    return hit[1]
+
+
+file_stem = f"conversation_{cur_session['name'].replace(' ', '_')}"
+if st.checkbox("📦 Préparer les exports de cette conversation", key="show_exports"):
+    st.download_button(
+        "📥 Télécharger la conversation en .md",
+        data=cached_export(cur_session, "md"),
+        file_name=f"{file_stem}.md",
+        mime="text/markdown",
+    )
+    st.download_button(
+        "⬇️ Export JSON (pour ré-importer plus tard)",
+        data=cached_export(cur_session, "json"),
+        file_name=f"{file_stem}.json",
+        mime="application/json",
+    )
+
+# --- Export de toutes les conversations (JSONL zippé, écrit en flux) ---
+all_version = tuple(
+    (s["id"],) + session_version(s) for s in st.session_state.sessions_data["sessions"]
 )
+archive = st.session_state.get("sessions_archive")
+if st.button("🗜️ Préparer l’archive de toutes les conversations"):
+    if archive is None or archive[0] != all_version:
+        from exports import write_sessions_archive
+        with st.spinner("Écriture de l’archive…"):
+            new_path = write_sessions_archive(st.session_state.sessions_data["sessions"])
+        if archive is not None:
+            # Archive périmée de cette session (fichier propre à la session)
+            archive[1].unlink(missing_ok=True)
+        archive = (all_version, new_path)
+        st.session_state.sessions_archive = archive
+if archive is not None and archive[0] == all_version and archive[1].exists():
+    # Lien vers le fichier statique : pas de relecture de l'archive à chaque rerun
+    from exports import archive_url
+    st.markdown(
+        f'<a href="{archive_url(archive[1])}" download="conversations.zip">'
+        "⬇️ Télécharger toutes les conversations (.zip, JSONL)</a>",
+        unsafe_allow_html=True,
+    )
 
 # --- Import JSON ---
 uploaded_conv = st.file_uploader(
@@ -566,7 +900,7 @@ if uploaded_conv is not None:
             # nouvelle session à partir de cet historique
             sessions = st.session_state.sessions_data["sessions"]
             new_name = f"Conversation importée {len(sessions)+1}"
-            new_id = f"session-{len(sessions)+1}"
+            new_id = next_session_id()
             new_sess = {
                 "id": new_id,
                 "name": new_name,
@@ -575,6 +909,7 @@ if uploaded_conv is not None:
                 "history": imported,
             }
             sessions.append(new_sess)
+            get_search_index().add_session(new_sess)
             switch_session(new_id)
             st.success(f"Conversation importée sous le nom : {new_name}")
             st.experimental_rerun()
@@ -586,34 +921,21 @@ if uploaded_conv is not None:
 
 # --- Résumé automatique de la conversation ---
 def summarize_current_conversation():
+    """
+    Résumé incrémental : seuls les messages ajoutés depuis le dernier
+    résumé sont envoyés au LLM ; sans nouveau message, le résumé stocké
+    dans la session est renvoyé directement (voir conversation_summary.py).
+    """
     if not cur_history:
         return "Il n'y a encore aucun message dans cette conversation."
 
-    conv_txt = ""
-    for msg in cur_history:
-        speaker = APP_USER_NAME if msg["role"] == "user" else BOT_NAME
-        conv_txt += f"{speaker} : {msg.get('content','')}\n"
-
     try:
-        from langchain_community.chat_models import ChatOllama
-        from langchain.prompts import ChatPromptTemplate
-        from langchain.schema.output_parser import StrOutputParser
-
-        prompt = ChatPromptTemplate.from_template(
-            "Tu es un assistant qui résume des conversations.\n"
-            "On te donne une conversation entre un utilisateur et un assistant.\n"
-            "Fais un résumé clair, structuré en sections (Contexte, Points clés, "
-            "Questions importantes, Pistes de travail).\n\n"
-            "CONVERSATION :\n{conversation}\n\nRÉSUMÉ :"
-        )
+        from conversation_summary import RollingSummarizer
 
-        try:
-            llm = ChatOllama(model="llama3.2:1b", temperature=0.2)
-        except Exception:
-            llm = ChatOllama(model="phi3:mini", temperature=0.2)
-
-        chain = prompt | llm | StrOutputParser()
-        return chain.invoke({"conversation": conv_txt})
+        summary, cached = RollingSummarizer().update(cur_session, APP_USER_NAME, BOT_NAME)
+        if not cached:
+            save_sessions()
+        return summary
     except Exception as e:
         return f"Impossible de générer le résumé (erreur : {e})"
 
@@ -710,6 +1032,39 @@ user_text = st.text_input(
     placeholder="Ex : Qu’est-ce que le deep learning ?",
 )
 
+@st.cache_data(show_spinner=False)
+def cached_source_index(db_dir: str, mtime: float):
+    from source_index import load_source_index
+    return load_source_index(db_dir)
+
+
+def indexed_sources(db_dir: str):
+    """Documents indexés (lu depuis source_index.json, sans ouvrir Chroma)."""
+    from source_index import source_index_path
+    path = source_index_path(db_dir)
+    if not path.exists():
+        return {}
+    return cached_source_index(db_dir, path.stat().st_mtime)["sources"]
+
+
+# Sélecteur de documents : la recherche ne porte que sur les documents choisis
+available_sources = indexed_sources(current_corpus()["db_dir"])
+if available_sources:
+    cur_sess_for_filter = get_current_session()
+    saved_filter = [s for s in cur_sess_for_filter.get("sources_filter", []) if s in available_sources]
+    selected_sources = st.multiselect(
+        "📚 Limiter la recherche à ces documents (vide = tous)",
+        sorted(available_sources),
+        default=saved_filter,
+        format_func=lambda src: f"{Path(src).name} ({len(available_sources[src]['chunk_ids'])} chunks)",
+        key=f"doc_filter_{cur_sess_for_filter['id']}_{current_corpus()['name']}",
+    )
+    if selected_sources != cur_sess_for_filter.get("sources_filter", []):
+        cur_sess_for_filter["sources_filter"] = selected_sources
+        save_sessions()
+else:
+    selected_sources = []
+
 col_input1, col_input2 = st.columns([3, 1])
 
 with col_input1:
@@ -733,9 +1088,31 @@ if send_clicked:
         time.sleep(0.6)
 
         # Génération de la réponse
+        sources = []
         try:
-            with st.spinner("Réflexion…"):
-                answer = st.session_state.chain.invoke({"question": q})
+            import profiling
+
+            sess = get_current_session()
+            turn = len(sess["history"]) - 1  # indice du message utilisateur
+            profile_question = profiling.profile_run("question", enabled=profiling_requested())
+            with st.spinner("Réflexion…"), profile_question:
+                with lease_chain() as chain:
+                    result = chain.invoke({
+                        "question": q,
+                        "sources": selected_sources or None,
+                        # Derniers échanges : reformulation des questions de suivi
+                        "history": sess["history"][:turn],
+                        "session_id": sess["id"],
+                        "turn": turn,
+                    })
+            answer = result["answer"]
+            if result.get("search_query", q) != q:
+                # Conservée pour les questions de suivi suivantes
+                sess["history"][turn]["search_query"] = result["search_query"]
+            from rag_pipeline import chunk_references
+            sources = [
+                ref for d in result.get("docs", []) for ref in chunk_references(d.metadata)
+            ]
         except Exception as e:
             answer = f"Erreur : {e}"
 
@@ -746,15 +1123,18 @@ if send_clicked:
             render_chat(partial_bot_text=partial)
             time.sleep(0.012)
 
-        append_message("assistant", answer)
+        append_message("assistant", answer, sources=sources)
         st.rerun()
 else:
     render_chat()
 
 # Zone d'affichage des réponses épinglées
 with st.expander("📌 Réponses importantes (épinglées)", expanded=False):
+    # Indices épinglés tenus à jour par l'index : pas de parcours de l'historique
+    pinned_hist = get_current_session()["history"]
     pinned_msgs = [
-        m for m in get_current_session()["history"] if m.get("pinned") and m.get("role") == "assistant"
+        pinned_hist[i] for i in get_search_index().pinned_indices(get_current_session()["id"])
+        if i < len(pinned_hist) and pinned_hist[i].get("role") == "assistant"
     ]
     if not pinned_msgs:
         st.write("Aucune réponse épinglée pour l’instant.")
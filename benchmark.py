@@ -0,0 +1,243 @@
+# benchmark.py
+"""
+Mesures de performance du projet.
+
+    python benchmark.py importtime     # profil d'import (python -X importtime)
+    python benchmark.py retrieval      # plate vs deux temps vs int8 (latence, rappel, mémoire)
+"""
+import argparse
+import ast
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+APP_PATH = Path(__file__).with_name("app.py")
+
+# Modules lourds importés à la demande (chaîne RAG, indexation)
+HEAVY_IMPORTS = [
+    "langchain_community.vectorstores",
+    "langchain_community.embeddings",
+    "langchain_community.chat_models",
+    "langchain_community.document_loaders",
+    "chromadb",
+]
+
+
+
+def app_startup_imports(path=APP_PATH):
+    """
+    Modules importés par le script app.py au premier affichage : imports
+    du niveau module et des blocs with / try (toujours exécutés). Les
+    imports dans des fonctions ou des branches if (clic, upload…) sont à
+    la demande.
+    """
+    modules = []
+
+    def visit(body):
+        for stmt in body:
+            if isinstance(stmt, ast.Import):
+                modules.extend(alias.name for alias in stmt.names)
+            elif isinstance(stmt, ast.ImportFrom) and stmt.module and not stmt.level:
+                modules.append(stmt.module)
+            elif isinstance(stmt, (ast.With, ast.AsyncWith)):
+                visit(stmt.body)
+            elif isinstance(stmt, ast.Try):
+                visit(stmt.body)
+
+    visit(ast.parse(Path(path).read_text(encoding="utf-8")).body)
+    return list(dict.fromkeys(modules))
+
+
+def import_profiles():
+    startup = app_startup_imports()
+    return {
+        "app.py (démarrage, imports paresseux)": startup,
+        "app.py (si tout était importé au démarrage)": startup + HEAVY_IMPORTS,
+        "rag_pipeline (chaîne en arrière-plan)": ["rag_pipeline"],
+        "build_index (à la demande)": ["build_index"],
+    }
+
+
+def parse_importtime(stderr: str):
+    """
+    Analyse la sortie de `python -X importtime`.
+    Retourne (total_us, [(cumulé_us, propre_us, module), ...]).
+    """
+    rows = []
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumul_us, name = line[len("import time:"):].split("|")
+            self_us, cumul_us = int(self_us), int(cumul_us)
+        except ValueError:
+            continue
+        # Les modules de premier niveau ne sont pas indentés
+        if not name[1:].startswith(" "):
+            total += cumul_us
+        rows.append((cumul_us, self_us, name.strip()))
+    return total, rows
+
+
+def importtime_profile(modules, top=10):
+    """Importe `modules` dans un interpréteur neuf avec -X importtime."""
+    code = "; ".join(f"import {m}" for m in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=str(APP_PATH.parent),
+    )
+    total, rows = parse_importtime(proc.stderr)
+    rows.sort(reverse=True)
+    error = None
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "erreur"
+    return {"total_ms": total / 1000, "top": rows[:top], "error": error}
+
+
+def run_importtime(top=10):
+    print("⏱️ Profil d'import (python -X importtime)\n")
+    for label, modules in import_profiles().items():
+        res = importtime_profile(modules, top=top)
+        print(f"## {label} — {res['total_ms']:.0f} ms")
+        if res["error"]:
+            print(f"   ⚠️ {res['error']}")
+        for cumul_us, self_us, name in res["top"]:
+            print(f"   {cumul_us / 1000:9.1f} ms (propre {self_us / 1000:7.1f} ms)  {name}")
+        print()
+
+
+# Questions réelles utilisées par défaut pour la recherche
+DEFAULT_QUERIES_FILE = str(Path(__file__).with_name("benchmark_queries.txt"))
+
+
+def sample_queries(vectordb, n_queries, queries_file=None, seed=0):
+    """
+    Vecteurs de requêtes : questions d'un fichier (une par ligne, embeddées
+    via Ollama) ou, si queries_file est None, embeddings de chunks tirés au
+    hasard. Ces derniers donnent un rappel optimiste : le document du chunk
+    interrogé ressort toujours au premier niveau de la recherche en deux temps.
+    """
+    if queries_file:
+        with open(queries_file, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        return [vectordb.embeddings.embed_query(q) for q in questions[:n_queries]]
+    col = vectordb._collection
+    ids = col.get(include=[])["ids"]
+    random.Random(seed).shuffle(ids)
+    got = col.get(ids=ids[:n_queries], include=["embeddings"])
+    return [list(v) for v in got["embeddings"]]
+
+
+def timed_search(fn, queries):
+    """Exécute fn(query) pour chaque requête ; retourne (résultats, latences ms)."""
+    results, latencies = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        results.append(fn(q))
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return results, latencies
+
+
+def latency_summary(latencies):
+    lat = sorted(latencies)
+    p95 = lat[min(len(lat) - 1, int(0.95 * len(lat)))]
+    return f"moy {statistics.mean(lat):7.2f} ms — p95 {p95:7.2f} ms"
+
+
+def recall_at_k(reference, candidate):
+    """Rappel moyen : part des résultats de référence retrouvés."""
+    scores = []
+    for ref, cand in zip(reference, candidate):
+        ref_ids = {d.metadata.get("chunk_id") for d in ref}
+        if ref_ids:
+            scores.append(len(ref_ids & {d.metadata.get("chunk_id") for d in cand}) / len(ref_ids))
+    return statistics.mean(scores) if scores else 0.0
+
+
+def run_retrieval(db_dir, k=3, docs_list=(2, 4, 8), n_queries=50, queries_file=None,
+                  rescore_factors=(1, 4)):
+    from quantization import Int8Index
+    from rag_pipeline import (
+        make_vectorstore, open_doc_collection, search_flat, search_quantized, search_two_stage,
+    )
+
+    vectordb = make_vectorstore(db_dir)
+    doc_col = open_doc_collection(db_dir)
+    queries = sample_queries(vectordb, n_queries, queries_file)
+    if not queries:
+        print("❌ Index vide : lance d'abord build_index.py")
+        return
+
+    origin = (f"questions de {queries_file}" if queries_file
+              else "chunks indexés — rappel optimiste pour la recherche en deux temps")
+    print(f"🔎 Recherche : {len(queries)} requêtes ({origin}), k={k}, "
+          f"{vectordb._collection.count()} chunks\n")
+    flat, flat_lat = timed_search(lambda q: search_flat(vectordb, q, k=k), queries)
+    print(f"{'plate':<22} {latency_summary(flat_lat)} — rappel@{k} 1.000 (référence)")
+
+    if doc_col is None:
+        print("⚠️ Pas d'index de documents : reconstruis l'index pour la recherche en deux temps.")
+    else:
+        for n_docs in docs_list:
+            two, two_lat = timed_search(
+                lambda q: search_two_stage(vectordb, doc_col, q, k=k, n_docs=n_docs), queries
+            )
+            label = f"deux temps ({n_docs} docs)"
+            print(f"{label:<22} {latency_summary(two_lat)} — rappel@{k} {recall_at_k(flat, two):.3f}")
+
+    qindex = Int8Index.load(db_dir)
+    if qindex is None:
+        # Pas d'index int8 sur disque : construit en mémoire pour la mesure
+        got = vectordb._collection.get(include=["embeddings"])
+        qindex = Int8Index.build(got["ids"], got["embeddings"])
+        print("ℹ️ Index int8 construit en mémoire (build_index avec RAG_QUANTIZE=1 pour le persister).")
+    for factor in rescore_factors:
+        quant, quant_lat = timed_search(
+            lambda q: search_quantized(vectordb, qindex, q, k=k, rescore_k=k * factor), queries
+        )
+        label = f"int8 (rescore {k * factor})"
+        print(f"{label:<22} {latency_summary(quant_lat)} — rappel@{k} {recall_at_k(flat, quant):.3f}")
+    mem = qindex.memory_report(rescore_k=k * max(rescore_factors))
+    print(f"\n🗜️ Index int8 : +{mem['disk_delta_bytes'] / 1e6:.1f} Mo sur disque en plus de l'index Chroma "
+          f"(codes {mem['int8_bytes'] / 1e6:.1f} Mo, vecteurs exacts {mem['exact_bytes'] / 1e6:.1f} Mo)")
+    print(f"   Résident : {mem['resident_bytes'] / 1e6:.1f} Mo (scan int8 + re-classement) "
+          f"contre {mem['float32_bytes'] / 1e6:.1f} Mo de vecteurs float32 pour la recherche Chroma "
+          f"— scan x{mem['scan_ratio']:.1f} plus léger")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks du RAG Chatbot")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_imp = sub.add_parser("importtime", help="profil d'import au démarrage")
+    p_imp.add_argument("--top", type=int, default=10)
+
+    p_ret = sub.add_parser("retrieval", help="recherche plate vs deux temps")
+    p_ret.add_argument("--db-dir", default="chroma")
+    p_ret.add_argument("--k", type=int, default=3)
+    p_ret.add_argument("--docs", type=int, nargs="+", default=[2, 4, 8],
+                       help="documents examinés au premier niveau")
+    p_ret.add_argument("--queries", type=int, default=50)
+    p_ret.add_argument("--queries-file", default=DEFAULT_QUERIES_FILE,
+                       help="questions, une par ligne")
+    p_ret.add_argument("--chunk-queries", action="store_true",
+                       help="requêtes = embeddings de chunks indexés (rappel optimiste)")
+    p_ret.add_argument("--rescore", type=int, nargs="+", default=[1, 4],
+                       help="facteurs de re-classement int8 (candidats = k * facteur)")
+
+    args = parser.parse_args(argv)
+    if args.command == "importtime":
+        run_importtime(top=args.top)
+    elif args.command == "retrieval":
+        run_retrieval(args.db_dir, k=args.k, docs_list=args.docs,
+                      n_queries=args.queries,
+                      queries_file=None if args.chunk_queries else args.queries_file,
+                      rescore_factors=args.rescore)
+
+
+if __name__ == "__main__":
+    main()
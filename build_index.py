@@ -1,19 +1,138 @@
 # build_index.py
 from pathlib import Path
+from datetime import datetime
 import os
 from load_documents import load_all_documents, split_docs
+from dedup import dedup_chunks
+from quantization import Int8Index
+from profiling import profile_stage, profiled
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
+from rag_pipeline import DOC_COLLECTION
+from source_index import (
+    build_source_index, chunk_ids_for, doc_id_for, doc_key, load_source_index, save_source_index,
+)
 
 
 # Répertoire des embeddings
 DB_DIR = "chroma"
 
+# Taille des lots envoyés à Chroma (limite max_batch_size du client)
+UPSERT_BATCH = 1000
 
-def build_index(data_dir="data", persist_dir=DB_DIR, embed_model="nomic-embed-text"):
+
+def annotate_chunks(chunks, ingested_at):
+    """
+    Ajoute des métadonnées structurées à chaque chunk :
+    source, page (PDF), type de fichier, date d'ingestion, doc_id, chunk_id.
+    Les chunk_id sont stables (doc_id + rang) : une réindexation remplace
+    les chunks existants au lieu de les dupliquer.
+    """
+    counters = {}
+    for c in chunks:
+        meta = c.metadata
+        source = Path(meta.get("source", "inconnu")).as_posix()
+        doc_id = doc_id_for(source)
+        rank = counters.get(doc_id, 0)
+        counters[doc_id] = rank + 1
+        meta["source"] = source
+        meta["file_type"] = Path(source).suffix.lower().lstrip(".")
+        meta["ingested_at"] = ingested_at
+        meta["doc_id"] = doc_id
+        meta["chunk_id"] = f"{doc_id}-{rank:05d}"
+        # Chroma n'accepte pas les valeurs None dans les métadonnées
+        for key in [k for k, v in meta.items() if v is None]:
+            del meta[key]
+    return chunks
+
+
+def upsert_chunks(collection, ids, chunks, vectors):
+    """
+    Ajoute / remplace les chunks avec leurs vecteurs déjà calculés.
+    L'upsert de Chroma fusionne les métadonnées : un chunk déjà indexé dont
+    une clé a disparu (in_doc_*, duplicates, all_sources… après une
+    déduplication différente) est d'abord supprimé, sinon la clé périmée
+    resterait et les filtres par document le retrouveraient à tort.
+    """
+    for i in range(0, len(ids), UPSERT_BATCH):
+        j = i + UPSERT_BATCH
+        existing = collection.get(ids=ids[i:j], include=["metadatas"])
+        new_keys = {cid: set(c.metadata) for cid, c in zip(ids[i:j], chunks[i:j])}
+        outdated = [
+            cid for cid, meta in zip(existing["ids"], existing["metadatas"])
+            if set(meta or {}) - new_keys[cid]
+        ]
+        if outdated:
+            collection.delete(ids=outdated)
+        collection.upsert(
+            ids=ids[i:j],
+            embeddings=vectors[i:j],
+            metadatas=[c.metadata for c in chunks[i:j]],
+            documents=[c.page_content for c in chunks[i:j]],
+        )
+
+
+def document_vectors(chunks, vectors):
+    """
+    Un vecteur par document : moyenne des embeddings (normalisés) de ses
+    chunks. Sert d'index de premier niveau pour la recherche en deux temps.
+    """
+    import numpy as np
+
+    groups = {}
+    for c, v in zip(chunks, vectors):
+        groups.setdefault(c.metadata["doc_id"], []).append((c, v))
+
+    out = {}
+    for doc_id, items in groups.items():
+        arr = np.asarray([v for _, v in items], dtype=np.float32)
+        arr /= np.linalg.norm(arr, axis=1, keepdims=True) + 1e-12
+        mean = arr.mean(axis=0)
+        mean /= np.linalg.norm(mean) + 1e-12
+        first = items[0][0]
+        out[doc_id] = {
+            "embedding": mean.tolist(),
+            "metadata": {
+                "source": first.metadata["source"],
+                "file_type": first.metadata.get("file_type", ""),
+                "chunks": len(items),
+            },
+            # Court extrait du début du document (lisibilité / debug)
+            "document": first.page_content[:300],
+        }
+    return out
+
+
+def save_document_index(persist_dir, doc_vecs):
+    """Écrit les vecteurs de documents dans une petite collection dédiée."""
+    import chromadb
+
+    client = chromadb.PersistentClient(persist_dir)
+    col = client.get_or_create_collection(DOC_COLLECTION, metadata={"hnsw:space": "cosine"})
+    stale = set(col.get(include=[])["ids"]) - set(doc_vecs)
+    if stale:
+        col.delete(ids=sorted(stale))
+    ids = sorted(doc_vecs)
+    for i in range(0, len(ids), UPSERT_BATCH):
+        batch = ids[i:i + UPSERT_BATCH]
+        col.upsert(
+            ids=batch,
+            embeddings=[doc_vecs[d]["embedding"] for d in batch],
+            metadatas=[doc_vecs[d]["metadata"] for d in batch],
+            documents=[doc_vecs[d]["document"] for d in batch],
+        )
+    return col.count()
+
+
+@profiled("build_index")
+def build_index(data_dir="data", persist_dir=DB_DIR, embed_model="nomic-embed-text", dedup=True,
+                quantize=None):
     """
     Construit l'index Chroma à partir des documents PDF/TXT/MD/DOCX dans ./data.
+    quantize=True ajoute un index int8 pour la recherche (défaut : RAG_QUANTIZE=1).
     """
+    if quantize is None:
+        quantize = os.environ.get("RAG_QUANTIZE", "0") == "1"
     print("🔍 Chargement des documents...")
 
     docs = load_all_documents(data_dir)
@@ -24,24 +143,100 @@ def build_index(data_dir="data", persist_dir=DB_DIR, embed_model="nomic-embed-te
         return
 
     print(f"📄 {len(docs)} documents chargés, {len(chunks)} chunks générés.")
+
+    ingested_at = datetime.now().isoformat(timespec="seconds")
+    annotate_chunks(chunks, ingested_at)
+
+    # Fusion des chunks quasi-dupliqués (versions multiples d'un même support).
+    # all_chunks garde tous les chunks ; canonical_of[i] = chunk indexé pour all_chunks[i]
+    all_chunks = chunks
+    if dedup:
+        with profile_stage("dedup"):
+            chunks, canonical_of, report = dedup_chunks(all_chunks)
+        print(
+            f"♻️ Déduplication : {report['chunks_in']} → {report['chunks_out']} chunks "
+            f"({report['groups_merged']} groupes fusionnés, "
+            f"{report['saved']} embeddings économisés)."
+        )
+    else:
+        canonical_of = list(range(len(all_chunks)))
+    # Un chunk indexé appartient à tous les documents qu'il représente :
+    # les filtres par document (doc_filter) le retrouvent pour chacun d'eux
+    for i, c in enumerate(all_chunks):
+        chunks[canonical_of[i]].metadata[doc_key(c.metadata["doc_id"])] = True
+    ids = [c.metadata["chunk_id"] for c in chunks]
+
     print("🧠 Génération des embeddings avec Ollama...")
 
     # Désactive le GPU pour Ollama (utile sur CPU)
     os.environ["OLLAMA_NUM_GPU"] = "0"
 
-    # Embeddings Ollama
+    # Embeddings Ollama (calculés une fois, réutilisés pour l'index documents)
     embeddings = OllamaEmbeddings(model=embed_model)
+    with profile_stage("embedding"):
+        vectors = embeddings.embed_documents([c.page_content for c in chunks])
 
-    # Création du vecteurstore
-    vectordb = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=persist_dir
+    # Création / mise à jour du vecteurstore
+    vectordb = Chroma(persist_directory=persist_dir, embedding_function=embeddings)
+    upsert_chunks(vectordb._collection, ids, chunks, vectors)
+
+    # Nettoyage des chunks obsolètes (documents supprimés ou raccourcis)
+    old_index = load_source_index(persist_dir)
+    if old_index["built_at"] is None:
+        # Pas d'index des sources (index créé par une ancienne version, IDs
+        # aléatoires) : on compare avec tous les IDs présents dans Chroma
+        previous = vectordb._collection.get(include=[])["ids"]
+    else:
+        previous = chunk_ids_for(old_index, old_index["sources"])
+    stale = set(previous) - set(ids)
+    if stale:
+        vectordb.delete(ids=sorted(stale))
+        print(f"🧹 {len(stale)} chunks obsolètes supprimés.")
+
+    # Index de premier niveau : un vecteur par document (recherche en deux temps),
+    # chaque document gardant aussi les chunks fusionnés dans ceux d'un autre
+    n_docs = save_document_index(
+        persist_dir, document_vectors(all_chunks, [vectors[j] for j in canonical_of])
+    )
+    print(f"🗂️ {n_docs} vecteurs de documents (index de premier niveau).")
+
+    # Index précalculé source → chunk IDs (filtrage, sélecteur, stats)
+    # (tous les chunks d'origine, rattachés aux IDs effectivement indexés).
+    # Écrit après l'index de documents : les chaînes ouvertes s'y fient pour
+    # détecter une reconstruction (voir rag_pipeline.doc_collection_loader)
+    save_source_index(
+        persist_dir,
+        build_source_index(all_chunks, ingested_at, chunk_ids=[ids[j] for j in canonical_of]),
     )
 
+    # Index int8 optionnel (+ vecteurs exacts en mmap pour le re-classement),
+    # en plus de l'index Chroma
+    if quantize:
+        qindex = Int8Index.build(ids, vectors)
+        qindex.save(persist_dir)
+        mem = qindex.memory_report()
+        print(
+            f"🗜️ Index int8 : +{mem['disk_delta_bytes'] / 1e6:.1f} Mo sur disque en plus de Chroma "
+            f"(codes {mem['int8_bytes'] / 1e6:.1f} Mo, vecteurs exacts {mem['exact_bytes'] / 1e6:.1f} Mo) ; "
+            f"scan x{mem['scan_ratio']:.1f} plus léger qu'en float32."
+        )
+    else:
+        # Un ancien index int8 ne correspondrait plus aux chunks
+        Int8Index.remove(persist_dir)
+
     print(f"✅ [OK] Index mis à jour ({vectordb._collection.count()} chunks) → {persist_dir}")
 
 
 if __name__ == "__main__":
-    Path(DB_DIR).mkdir(parents=True, exist_ok=True)
-    build_index()
+    import argparse
+    from corpora import create_corpus, get_corpus, DEFAULT_CORPUS
+
+    parser = argparse.ArgumentParser(description="Construit / met à jour l'index d'un corpus.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS,
+                        help="nom du corpus (créé s'il n'existe pas)")
+    args = parser.parse_args()
+
+    corpus = get_corpus(args.corpus) if args.corpus == DEFAULT_CORPUS else create_corpus(args.corpus)
+    Path(corpus["db_dir"]).mkdir(parents=True, exist_ok=True)
+    print(f"📚 Corpus « {corpus['name']} » : {corpus['data_dir']} → {corpus['db_dir']}")
+    build_index(data_dir=corpus["data_dir"], persist_dir=corpus["db_dir"])
@@ -0,0 +1,190 @@
+# chat_search.py
+"""
+Recherche plein texte dans toutes les conversations.
+
+Index inversé incrémental (terme → messages) mis à jour à chaque ajout /
+suppression de message, avec classement BM25, filtres (session, rôle,
+dates, épinglés) et extraits surlignés. Une requête ne parcourt que les
+listes des termes recherchés : le coût ne dépend pas du nombre de sessions.
+"""
+import html
+import math
+import re
+import unicodedata
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = {
+    "le", "la", "les", "un", "une", "des", "de", "du", "et", "ou", "en", "au",
+    "aux", "a", "est", "que", "qui", "dans", "pour", "par", "sur", "ce", "ces",
+    "il", "elle", "on", "je", "tu", "nous", "vous", "ils", "se", "ne", "pas",
+    "the", "of", "and", "to", "is", "in",
+}
+
+# Paramètres BM25
+K1 = 1.2
+B = 0.75
+
+
+def normalize(word: str) -> str:
+    """Minuscules, sans accents."""
+    word = unicodedata.normalize("NFKD", word.lower())
+    return "".join(ch for ch in word if not unicodedata.combining(ch))
+
+
+def tokenize(text: str):
+    for m in _TOKEN_RE.finditer(text or ""):
+        tok = normalize(m.group())
+        if len(tok) > 1 and tok not in STOPWORDS:
+            yield tok
+
+
+class ChatSearchIndex:
+    """Index inversé des messages, clé = (session_id, indice du message)."""
+
+    def __init__(self):
+        self.postings = {}    # terme -> {clé: fréquence}
+        self.docs = {}        # clé -> infos du message
+        self.pinned = {}      # session_id -> set(indices épinglés)
+        self.by_session = {}  # session_id -> set(indices indexés)
+        self.total_len = 0
+
+    @classmethod
+    def from_sessions(cls, sessions):
+        index = cls()
+        for sess in sessions:
+            index.add_session(sess)
+        return index
+
+    # ---------- mises à jour ----------
+    def add_session(self, session):
+        for i, msg in enumerate(session.get("history", [])):
+            self.add_message(session["id"], i, msg)
+
+    def add_message(self, session_id, idx, msg):
+        key = (session_id, idx)
+        if key in self.docs:
+            self.remove_message(session_id, idx)
+        counts = {}
+        for tok in tokenize(msg.get("content", "")):
+            counts[tok] = counts.get(tok, 0) + 1
+        for tok, tf in counts.items():
+            self.postings.setdefault(tok, {})[key] = tf
+        length = sum(counts.values())
+        self.docs[key] = {
+            "terms": list(counts),
+            "len": length,
+            "role": msg.get("role", "assistant"),
+            "date": msg.get("date", ""),
+            "time": msg.get("time", ""),
+            "content": msg.get("content", ""),
+        }
+        self.total_len += length
+        self.by_session.setdefault(session_id, set()).add(idx)
+        if msg.get("pinned"):
+            self.pinned.setdefault(session_id, set()).add(idx)
+
+    def remove_message(self, session_id, idx):
+        key = (session_id, idx)
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        for tok in doc["terms"]:
+            plist = self.postings.get(tok)
+            if plist is not None:
+                plist.pop(key, None)
+                if not plist:
+                    del self.postings[tok]
+        self.total_len -= doc["len"]
+        self.by_session.get(session_id, set()).discard(idx)
+        self.pinned.get(session_id, set()).discard(idx)
+
+    def remove_session(self, session_id):
+        for idx in list(self.by_session.get(session_id, ())):
+            self.remove_message(session_id, idx)
+        self.by_session.pop(session_id, None)
+        self.pinned.pop(session_id, None)
+
+    def set_pinned(self, session_id, idx, pinned=True):
+        if pinned:
+            self.pinned.setdefault(session_id, set()).add(idx)
+        else:
+            self.pinned.get(session_id, set()).discard(idx)
+
+    def pinned_indices(self, session_id):
+        """Indices des messages épinglés d'une session (ordre chronologique)."""
+        return sorted(self.pinned.get(session_id, ()))
+
+    # ---------- recherche ----------
+    def search(self, query, session_id=None, role=None, date_from=None, date_to=None,
+               pinned_only=False, limit=20):
+        """
+        Retourne les meilleurs messages : liste de dicts
+        {session_id, index, score, role, date, time, snippet}.
+        Dates au format "YYYY-MM-DD" (bornes incluses).
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.docs:
+            return []
+        n_docs = len(self.docs)
+        avgdl = self.total_len / n_docs if n_docs else 1.0
+
+        scores = {}
+        for tok in terms:
+            plist = self.postings.get(tok)
+            if not plist:
+                continue
+            idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for key, tf in plist.items():
+                dl = self.docs[key]["len"]
+                scores[key] = scores.get(key, 0.0) + idf * tf * (K1 + 1) / (
+                    tf + K1 * (1 - B + B * dl / avgdl)
+                )
+
+        hits = []
+        for key, score in sorted(scores.items(), key=lambda kv: -kv[1]):
+            sid, idx = key
+            doc = self.docs[key]
+            if session_id is not None and sid != session_id:
+                continue
+            if role is not None and doc["role"] != role:
+                continue
+            if date_from and doc["date"] < date_from:
+                continue
+            if date_to and doc["date"] > date_to:
+                continue
+            if pinned_only and idx not in self.pinned.get(sid, ()):
+                continue
+            hits.append({
+                "session_id": sid,
+                "index": idx,
+                "score": round(score, 3),
+                "role": doc["role"],
+                "date": doc["date"],
+                "time": doc["time"],
+                "snippet": highlight_snippet(doc["content"], terms),
+            })
+            if len(hits) >= limit:
+                break
+        return hits
+
+
+def highlight_snippet(text, terms, width=160):
+    """Extrait HTML autour du premier terme trouvé, termes surlignés (<mark>)."""
+    terms = set(terms)
+    matches = [m for m in _TOKEN_RE.finditer(text) if normalize(m.group()) in terms]
+    if not matches:
+        snippet = text[:width]
+        return html.escape(snippet) + ("…" if len(text) > width else "")
+
+    start = max(0, matches[0].start() - width // 3)
+    end = min(len(text), start + width)
+    out, pos = [], start
+    for m in matches:
+        if m.start() < start or m.end() > end:
+            continue
+        out.append(html.escape(text[pos:m.start()]))
+        out.append(f"<mark>{html.escape(m.group())}</mark>")
+        pos = m.end()
+    out.append(html.escape(text[pos:end]))
+    return ("…" if start > 0 else "") + "".join(out) + ("…" if end < len(text) else "")
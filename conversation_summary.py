@@ -0,0 +1,175 @@
+# conversation_summary.py
+"""
+Résumé incrémental (« rolling ») des conversations.
+
+Le résumé est stocké dans la session (clé "summary") avec le nombre de
+messages déjà intégrés et une empreinte de ces messages :
+- clic répété sans nouveau message → résumé en cache, instantané ;
+- nouveaux messages → seuls ceux-ci sont intégrés au résumé existant ;
+- longs historiques → découpage hiérarchique (map-reduce) pour rester
+  dans le contexte des petits modèles.
+"""
+import hashlib
+from datetime import datetime
+
+# Taille max (caractères) d'un extrait envoyé au LLM (~1500 tokens)
+MAX_CHUNK_CHARS = 6000
+# Niveaux de map-reduce au plus ; au-delà, fusion finale des résumés tronqués
+MAX_REDUCE_LEVELS = 3
+
+SECTIONS = "Contexte, Points clés, Questions importantes, Pistes de travail"
+
+MAP_PROMPT = (
+    "Tu es un assistant qui résume des conversations.\n"
+    "Voici un extrait d'une conversation entre un utilisateur et un assistant.\n"
+    "Résume-le de façon concise en gardant les faits, questions et décisions.\n\n"
+    "EXTRAIT :\n{conversation}\n\nRÉSUMÉ :"
+)
+
+REDUCE_PROMPT = (
+    "Tu es un assistant qui résume des conversations.\n"
+    "Voici plusieurs résumés partiels successifs d'une même conversation.\n"
+    f"Fusionne-les en un résumé clair, structuré en sections ({SECTIONS}).\n\n"
+    "RÉSUMÉS PARTIELS :\n{conversation}\n\nRÉSUMÉ :"
+)
+
+UPDATE_PROMPT = (
+    "Tu es un assistant qui résume des conversations.\n"
+    "Voici le résumé actuel d'une conversation, puis les nouveaux messages.\n"
+    "Mets à jour le résumé en y intégrant les nouveaux messages, structuré en "
+    f"sections ({SECTIONS}).\n\n"
+    "RÉSUMÉ ACTUEL :\n{summary}\n\nNOUVEAUX MESSAGES :\n{conversation}\n\n"
+    "RÉSUMÉ MIS À JOUR :"
+)
+
+FULL_PROMPT = (
+    "Tu es un assistant qui résume des conversations.\n"
+    "On te donne une conversation entre un utilisateur et un assistant.\n"
+    f"Fais un résumé clair, structuré en sections ({SECTIONS}).\n\n"
+    "CONVERSATION :\n{conversation}\n\nRÉSUMÉ :"
+)
+
+
+def fingerprint(messages) -> str:
+    """Empreinte des messages (détecte suppression / modification)."""
+    h = hashlib.sha1()
+    for msg in messages:
+        h.update(msg.get("role", "").encode("utf-8"))
+        h.update(b"\x00")
+        h.update(msg.get("content", "").encode("utf-8"))
+        h.update(b"\x01")
+    return h.hexdigest()
+
+
+def transcript_lines(messages, user_name, bot_name):
+    lines = []
+    for msg in messages:
+        speaker = user_name if msg.get("role") == "user" else bot_name
+        lines.append(f"{speaker} : {msg.get('content', '')}")
+    return lines
+
+
+def split_chunks(lines, max_chars=MAX_CHUNK_CHARS):
+    """Regroupe des lignes en blocs d'au plus max_chars caractères."""
+    chunks, current, size = [], [], 0
+    for line in lines:
+        # Un message trop long est lui-même découpé
+        pieces = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or [""]
+        for piece in pieces:
+            if current and size + len(piece) + 1 > max_chars:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class RollingSummarizer:
+    """Résumeur incrémental et hiérarchique, basé sur le routeur LLM."""
+
+    def __init__(self, llm=None, max_chars=MAX_CHUNK_CHARS, max_levels=MAX_REDUCE_LEVELS):
+        if llm is None:
+            from model_router import get_router
+            llm = get_router().as_runnable()
+        self.llm = llm
+        self.max_chars = max_chars
+        self.max_levels = max_levels
+
+    def _chain(self, template):
+        from langchain.prompts import ChatPromptTemplate
+        from langchain.schema.output_parser import StrOutputParser
+
+        return ChatPromptTemplate.from_template(template) | self.llm | StrOutputParser()
+
+    def _reduce(self, partials):
+        """
+        Fusionne des résumés partiels, par niveaux si nécessaire (au plus
+        max_levels). Si les résumés ne rétrécissent pas assez (petit modèle
+        trop bavard), fusion finale de résumés tronqués pour tenir dans un bloc.
+        """
+        for _level in range(self.max_levels):
+            if len(partials) <= 1:
+                return partials[0] if partials else ""
+            groups = split_chunks(partials, self.max_chars)
+            if len(groups) == 1:
+                return self._chain(REDUCE_PROMPT).invoke({"conversation": groups[0]})
+            partials = self._chain(MAP_PROMPT).batch(
+                [{"conversation": g} for g in groups], config={"max_concurrency": 2}
+            )
+        if len(partials) <= 1:
+            return partials[0] if partials else ""
+        budget = max(1, self.max_chars // len(partials) - 1)
+        return self._chain(REDUCE_PROMPT).invoke(
+            {"conversation": "\n".join(p[:budget] for p in partials)}
+        )
+
+    def summarize_lines(self, lines, previous=None):
+        """
+        Résume des lignes de transcript, en intégrant un éventuel résumé
+        précédent. Un seul appel LLM si tout tient dans un bloc.
+        """
+        chunks = split_chunks(lines, self.max_chars)
+        if len(chunks) == 1:
+            if previous:
+                return self._chain(UPDATE_PROMPT).invoke(
+                    {"summary": previous, "conversation": chunks[0]}
+                )
+            return self._chain(FULL_PROMPT).invoke({"conversation": chunks[0]})
+
+        # Map : un résumé partiel par bloc (en parallèle), puis reduce
+        partials = self._chain(MAP_PROMPT).batch(
+            [{"conversation": c} for c in chunks], config={"max_concurrency": 2}
+        )
+        if previous:
+            partials = [previous] + partials
+        return self._reduce(partials)
+
+    def update(self, session, user_name, bot_name):
+        """
+        Met à jour (si besoin) le résumé stocké dans session["summary"].
+        Retourne (texte, depuis_le_cache).
+        """
+        history = session.get("history", [])
+        state = session.get("summary") or {}
+        upto = state.get("upto", 0)
+
+        if state and upto <= len(history) and fingerprint(history[:upto]) == state.get("fingerprint"):
+            if upto == len(history):
+                return state["text"], True
+            new_messages, previous = history[upto:], state["text"]
+        else:
+            # Historique modifié (effacement, suppression…) : on repart de zéro
+            new_messages, previous = history, None
+
+        text = self.summarize_lines(
+            transcript_lines(new_messages, user_name, bot_name), previous=previous
+        )
+        session["summary"] = {
+            "text": text,
+            "upto": len(history),
+            "fingerprint": fingerprint(history),
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        return text, False
@@ -0,0 +1,238 @@
+# corpora.py
+"""
+Corpus nommés et isolés : chacun a son dossier de documents, son index
+Chroma (et donc ses statistiques, son index de sources, son index int8…).
+
+- Registre des corpus dans corpora.json ; le corpus "default" correspond
+  aux dossiers historiques ./data et ./chroma.
+- CorpusPool : ouvre les chaînes RAG à la demande (en arrière-plan) et
+  ferme, selon une politique LRU, celles restées inactives, pour que la
+  mémoire dépende du nombre de corpus actifs et non du nombre total.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+CORPORA_PATH = Path("corpora.json")
+CORPORA_ROOT = Path("corpora")
+DEFAULT_CORPUS = "default"
+
+# Nombre max de corpus ouverts simultanément
+MAX_ACTIVE = int(os.environ.get("RAG_MAX_ACTIVE_CORPORA", "3"))
+# Inactivité (s) au-delà de laquelle un corpus ouvert est fermé
+IDLE_TTL = float(os.environ.get("RAG_CORPUS_IDLE_TTL", "900"))
+
+
+def _default_entry():
+    return {"data_dir": "data", "db_dir": "chroma", "created_at": None}
+
+
+def load_registry() -> dict:
+    reg = {}
+    if CORPORA_PATH.exists():
+        try:
+            reg = json.loads(CORPORA_PATH.read_text(encoding="utf-8"))
+        except Exception:
+            reg = {}
+    corpora = reg.setdefault("corpora", {})
+    corpora.setdefault(DEFAULT_CORPUS, _default_entry())
+    return reg
+
+
+def save_registry(reg: dict):
+    CORPORA_PATH.write_text(json.dumps(reg, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def list_corpora():
+    """Noms des corpus, "default" en premier."""
+    names = sorted(load_registry()["corpora"])
+    names.remove(DEFAULT_CORPUS)
+    return [DEFAULT_CORPUS] + names
+
+
+def get_corpus(name: str) -> dict:
+    """Configuration d'un corpus (data_dir, db_dir) ; "default" si inconnu."""
+    corpora = load_registry()["corpora"]
+    entry = corpora.get(name) or corpora[DEFAULT_CORPUS]
+    return {"name": name if name in corpora else DEFAULT_CORPUS, **entry}
+
+
+def slugify(name: str) -> str:
+    slug = re.sub(r"[^a-z0-9_-]+", "-", name.strip().lower()).strip("-")
+    return slug or "corpus"
+
+
+def create_corpus(name: str) -> dict:
+    """Crée (ou retourne) un corpus avec ses propres dossiers."""
+    name = name.strip()
+    if not name:
+        raise ValueError("Le nom du corpus est vide.")
+    reg = load_registry()
+    if name not in reg["corpora"]:
+        used = {Path(c["data_dir"]).parent.as_posix() for c in reg["corpora"].values()}
+        slug = slugify(name)
+        base, n = CORPORA_ROOT / slug, 1
+        while base.as_posix() in used:  # deux noms, même slug : dossiers distincts
+            n += 1
+            base = CORPORA_ROOT / f"{slug}-{n}"
+        reg["corpora"][name] = {
+            "data_dir": (base / "data").as_posix(),
+            "db_dir": (base / "chroma").as_posix(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        save_registry(reg)
+    entry = reg["corpora"][name]
+    Path(entry["data_dir"]).mkdir(parents=True, exist_ok=True)
+    return {"name": name, **entry}
+
+
+def _release_chroma(db_dir: str):
+    """
+    Libère le client Chroma partagé d'un index (chromadb garde un « System »
+    par chemin tant que le processus vit). Au mieux : ignoré si l'API interne
+    de chromadb change.
+    """
+    try:
+        from chromadb.api.client import SharedSystemClient
+
+        systems = SharedSystemClient._identifier_to_system
+        target = os.path.abspath(db_dir)
+        for key in [k for k in systems if os.path.abspath(k) == target]:
+            systems.pop(key).stop()
+    except Exception:
+        pass
+
+
+class CorpusPool:
+    """
+    Chaînes RAG ouvertes par corpus, construites à la demande, éviction LRU.
+    Une chaîne s'utilise via lease() : un corpus en cours d'utilisation
+    (requête en cours dans une autre session) n'est jamais fermé. Les autres
+    accès directs à un index (construction, statistiques) le protègent via
+    hold() : son client Chroma n'est pas arrêté pendant ce temps.
+    """
+
+    def __init__(self, build_chain, max_active=MAX_ACTIVE, idle_ttl=IDLE_TTL):
+        self.build_chain = build_chain   # fonction(db_dir) -> chaîne
+        self.max_active = max_active
+        self.idle_ttl = idle_ttl
+        self._entries = OrderedDict()    # nom -> {"future", "db_dir", "last_used", "leases"}
+        self._holds = Counter()          # db_dir -> accès directs en cours (hold)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="corpus")
+
+    def _open(self, name: str, lease=False):
+        corpus = get_corpus(name)
+        with self._lock:
+            entry = self._entries.get(corpus["name"])
+            if entry is None:
+                entry = {
+                    "future": self._executor.submit(self.build_chain, corpus["db_dir"]),
+                    "db_dir": corpus["db_dir"],
+                    "leases": 0,
+                }
+                self._entries[corpus["name"]] = entry
+            entry["last_used"] = time.time()
+            if lease:
+                entry["leases"] += 1
+            self._entries.move_to_end(corpus["name"])
+            evicted = self._evict_locked(keep=corpus["name"])
+        for db_dir in evicted:
+            _release_chroma(db_dir)
+        return entry
+
+    def prefetch(self, name: str):
+        """Lance (si besoin) l'ouverture du corpus en arrière-plan."""
+        return self._open(name)["future"]
+
+    @contextmanager
+    def lease(self, name: str):
+        """
+        Chaîne du corpus (attend la fin de sa construction si besoin), protégée
+        de l'éviction pendant le bloc with.
+        """
+        entry = self._open(name, lease=True)
+        try:
+            try:
+                chain = entry["future"].result()
+            except Exception:
+                self.drop(name)
+                raise
+            yield chain
+        finally:
+            with self._lock:
+                entry["leases"] -= 1
+                entry["last_used"] = time.time()
+
+    @contextmanager
+    def hold(self, db_dir: str):
+        """
+        Protège l'index db_dir pendant un accès hors chaîne (build_index,
+        get_index_stats) : aucune éviction ne stoppe son client Chroma.
+        """
+        key = os.path.abspath(db_dir)
+        with self._lock:
+            self._holds[key] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._holds[key] -= 1
+                if not self._holds[key]:
+                    del self._holds[key]
+
+    def _held(self, db_dir) -> bool:
+        return self._holds.get(os.path.abspath(db_dir), 0) > 0
+
+    def status(self, name: str) -> str:
+        """"closed", "building", "ready" ou "error"."""
+        with self._lock:
+            entry = self._entries.get(get_corpus(name)["name"])
+        if entry is None:
+            return "closed"
+        future = entry["future"]
+        if not future.done():
+            return "building"
+        return "error" if future.exception() is not None else "ready"
+
+    def error(self, name: str):
+        with self._lock:
+            entry = self._entries.get(get_corpus(name)["name"])
+        if entry is None or not entry["future"].done():
+            return None
+        return entry["future"].exception()
+
+    def drop(self, name: str):
+        """Ferme un corpus (ex. après une construction en erreur)."""
+        with self._lock:
+            entry = self._entries.pop(get_corpus(name)["name"], None)
+            release = entry is not None and not self._held(entry["db_dir"])
+        if release:
+            _release_chroma(entry["db_dir"])
+
+    def active(self):
+        with self._lock:
+            return list(self._entries)
+
+    def _evict_locked(self, keep):
+        """Ferme les corpus inactifs trop longtemps, puis les moins récents."""
+        now = time.time()
+        evicted = []
+        for name in list(self._entries):
+            entry = self._entries[name]
+            too_many = len(self._entries) > self.max_active
+            idle = now - entry["last_used"] > self.idle_ttl
+            if (name == keep or entry["leases"] or not entry["future"].done()
+                    or self._held(entry["db_dir"])):
+                continue
+            if too_many or idle:
+                del self._entries[name]
+                evicted.append(entry["db_dir"])
+        return evicted
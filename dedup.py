@@ -0,0 +1,136 @@
+# dedup.py
+"""
+Élimination des chunks quasi-dupliqués avant l'embedding (MinHash + LSH).
+
+Les versions successives d'un même support (slides, rapports…) produisent des
+chunks presque identiques. On les regroupe en un chunk canonique qui garde
+la liste de toutes ses sources, ce qui économise embeddings, espace d'index
+et places dans le top-k.
+"""
+import hashlib
+import json
+import re
+
+import numpy as np
+
+# Nombre de permutations MinHash = BANDS * ROWS
+NUM_PERM = 64
+BANDS = 16
+ROWS = 4
+# Similarité de Jaccard (estimée) au-delà de laquelle deux chunks sont fusionnés
+THRESHOLD = 0.85
+# Taille des shingles (en mots)
+SHINGLE_SIZE = 5
+
+_MERSENNE = np.uint64((1 << 31) - 1)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _shingle_hashes(text, size=SHINGLE_SIZE):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else [""]
+    else:
+        grams = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little")
+         for g in grams),
+        dtype=np.uint64,
+    )
+
+
+class MinHasher:
+    """Signatures MinHash vectorisées (hachage universel modulo 2^31 - 1)."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=42):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, int(_MERSENNE), size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(_MERSENNE), size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        h = _shingle_hashes(text) % _MERSENNE
+        # (a*h + b) mod p tient dans un uint64 car a, h < 2^31
+        return ((np.outer(h, self.a) + self.b) % _MERSENNE).min(axis=0)
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def near_duplicate_groups(texts, threshold=THRESHOLD, bands=BANDS, rows=ROWS):
+    """
+    Regroupe les textes quasi-identiques.
+    Retourne une liste de groupes (listes d'indices), le premier indice de
+    chaque groupe étant le représentant canonique.
+    """
+    hasher = MinHasher(num_perm=bands * rows)
+    sigs = np.vstack([hasher.signature(t) for t in texts]) if texts else np.empty((0, bands * rows))
+    parent = list(range(len(texts)))
+
+    for band in range(bands):
+        buckets = {}
+        block = sigs[:, band * rows:(band + 1) * rows]
+        for i, row in enumerate(block):
+            buckets.setdefault(row.tobytes(), []).append(i)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            first = members[0]
+            for other in members[1:]:
+                ri, rj = _find(parent, first), _find(parent, other)
+                if ri == rj:
+                    continue
+                # Vérification du candidat : Jaccard estimée sur toute la signature
+                if np.mean(sigs[first] == sigs[other]) >= threshold:
+                    parent[max(ri, rj)] = min(ri, rj)
+
+    groups = {}
+    for i in range(len(texts)):
+        groups.setdefault(_find(parent, i), []).append(i)
+    return sorted(groups.values(), key=lambda g: g[0])
+
+
+def _reference(meta):
+    ref = {"source": meta.get("source", "inconnu")}
+    if "page" in meta:
+        ref["page"] = meta["page"]
+    return ref
+
+
+def dedup_chunks(chunks, threshold=THRESHOLD):
+    """
+    Fusionne les chunks quasi-dupliqués.
+    Le chunk canonique reçoit dans ses métadonnées :
+    - "duplicates" : nombre de chunks fusionnés (lui compris) ;
+    - "all_sources" : JSON de toutes les références {source, page}
+      (Chroma n'accepte que des valeurs scalaires).
+    Retourne (chunks_dédupliqués, canonique, rapport) : canonique[i] est
+    l'indice, dans chunks_dédupliqués, du chunk qui représente chunks[i].
+    """
+    groups = near_duplicate_groups([c.page_content for c in chunks], threshold=threshold)
+    kept = []
+    canonical_of = [0] * len(chunks)
+    for group in groups:
+        for i in group:
+            canonical_of[i] = len(kept)
+        canonical = chunks[group[0]]
+        if len(group) > 1:
+            refs = []
+            for i in group:
+                ref = _reference(chunks[i].metadata)
+                if ref not in refs:
+                    refs.append(ref)
+            canonical.metadata["duplicates"] = len(group)
+            canonical.metadata["all_sources"] = json.dumps(refs, ensure_ascii=False)
+        kept.append(canonical)
+
+    report = {
+        "chunks_in": len(chunks),
+        "chunks_out": len(kept),
+        "saved": len(chunks) - len(kept),
+        "groups_merged": sum(1 for g in groups if len(g) > 1),
+    }
+    return kept, canonical_of, report
@@ -0,0 +1,113 @@
+# exports.py
+"""
+Exports de conversations, générés à la demande et par morceaux.
+
+- Markdown / JSON d'une session : produits par des générateurs, assemblés
+  une seule fois par révision de la session (cache côté app).
+- Archive de toutes les sessions : JSONL compressé (zip) écrit en flux dans
+  un fichier, une session à la fois, sans tout garder en mémoire. Le
+  fichier est servi par le serveur statique de Streamlit (comme les PDF) :
+  le navigateur le télécharge directement, sans relecture à chaque rerun.
+"""
+import io
+import json
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from urllib.parse import quote
+
+# Dossier servi en statique (static/ : enableStaticServing)
+EXPORT_DIR = Path("static") / "exports"
+EXPORT_URL = "./app/static/exports"
+# Archives conservées : les plus récentes, et pas au-delà de cet âge (s)
+KEEP_ARCHIVES = 20
+ARCHIVE_MAX_AGE = 24 * 3600
+
+
+def iter_markdown(session, user_name, bot_name):
+    """Conversation au format Markdown, morceau par morceau."""
+    yield f"# Conversation — {session['name']}\n\n"
+    yield f"Créée le : {session['created_at']}\n"
+    yield f"Dernière activité : {session['last_used']}\n"
+    for msg in session["history"]:
+        speaker = user_name if msg["role"] == "user" else bot_name
+        yield f"\n**{speaker} ({msg.get('time','')} — {msg.get('date','')})**\n\n"
+        yield msg.get("content", "")
+        yield "\n"
+
+
+def iter_json_array(items):
+    """
+    Tableau JSON indenté, élément par élément (même rendu que
+    json.dumps(items, ensure_ascii=False, indent=2)).
+    """
+    if not items:
+        yield "[]"
+        return
+    yield "[\n"
+    for i, item in enumerate(items):
+        body = json.dumps(item, ensure_ascii=False, indent=2)
+        yield ("" if i == 0 else ",\n") + "\n".join("  " + line for line in body.splitlines())
+    yield "\n]"
+
+
+def assemble(chunks) -> bytes:
+    """Concatène les morceaux (str) dans un tampon UTF-8."""
+    buf = io.BytesIO()
+    for chunk in chunks:
+        buf.write(chunk.encode("utf-8"))
+    return buf.getvalue()
+
+
+def session_export(session, fmt, user_name, bot_name) -> bytes:
+    """Export d'une session : fmt = "md" ou "json" (historique ré-importable)."""
+    if fmt == "md":
+        return assemble(iter_markdown(session, user_name, bot_name))
+    if fmt == "json":
+        return assemble(iter_json_array(session["history"]))
+    raise ValueError(f"Format d'export inconnu : {fmt}")
+
+
+def cleanup_archives(keep=KEEP_ARCHIVES, max_age=ARCHIVE_MAX_AGE):
+    """Supprime les archives trop anciennes ou au-delà des `keep` plus récentes."""
+    if not EXPORT_DIR.exists():
+        return
+    now = time.time()
+    files = sorted(
+        EXPORT_DIR.glob("conversations-*.zip*"), key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    for i, path in enumerate(files):
+        if i >= keep or now - path.stat().st_mtime > max_age:
+            path.unlink(missing_ok=True)
+
+
+def archive_url(path) -> str:
+    """URL relative (serveur statique) d'une archive de EXPORT_DIR."""
+    return f"{EXPORT_URL}/{quote(Path(path).name)}"
+
+
+def write_sessions_archive(sessions, dest=None) -> Path:
+    """
+    Écrit toutes les sessions dans une archive zip contenant sessions.jsonl
+    (une session JSON par ligne), en flux vers le disque.
+    Sans dest : fichier unique dans EXPORT_DIR (une archive par appel,
+    jamais écrasée par une autre session du navigateur) ; les anciennes
+    archives sont nettoyées au passage.
+    """
+    if dest is None:
+        EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        cleanup_archives()
+        with tempfile.NamedTemporaryFile(
+            dir=EXPORT_DIR, prefix="conversations-", suffix=".zip", delete=False
+        ) as f:
+            dest = f.name
+    dest = Path(dest)
+    tmp = dest.with_suffix(".zip.part")
+    with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("sessions.jsonl", "w") as out:
+            for sess in sessions:
+                out.write(json.dumps(sess, ensure_ascii=False).encode("utf-8"))
+                out.write(b"\n")
+    tmp.replace(dest)
+    return dest
@@ -1,7 +1,9 @@
 from pathlib import Path
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from profiling import profiled
 
+@profiled("load_all_documents")
 def load_all_documents(data_dir="data"):
     """
     Charge tous les documents depuis un dossier :
@@ -35,6 +37,7 @@ def load_all_documents(data_dir="data"):
     return docs
 
 
+@profiled("split_docs")
 def split_docs(docs, chunk_size=800, chunk_overlap=120):
     """
     Divise les documents en morceaux (chunks) pour l’indexation.
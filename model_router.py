@@ -0,0 +1,356 @@
+# model_router.py
+"""
+Routage des requêtes LLM entre plusieurs modèles Ollama.
+
+- Health-check des modèles configurés au démarrage (via /api/tags).
+- Suivi des tokens/s observés et de la file d'attente (requêtes en cours).
+- Choix du modèle le plus rapide selon la taille du prompt et la charge.
+- Fallback automatique sur erreur ou timeout en cours de requête.
+- Journalisation des décisions dans un fichier JSONL pour analyse.
+"""
+import os
+import json
+import time
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+
+from profiling import profile_stage
+
+os.environ.setdefault("OLLAMA_NUM_GPU", "0")
+
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+if not OLLAMA_BASE_URL.startswith("http"):
+    OLLAMA_BASE_URL = f"http://{OLLAMA_BASE_URL}"
+
+# Modèles de chat, par ordre de préférence, avec des vitesses « a priori »
+# (tokens/s) utilisées tant qu'aucune mesure n'a été faite.
+CHAT_MODELS = {
+    "llama3.2:1b": {"gen_tps": 25.0, "prompt_tps": 250.0},
+    "phi3:mini": {"gen_tps": 12.0, "prompt_tps": 120.0},
+}
+
+# Nombre de tokens de sortie attendus pour une réponse type
+EXPECTED_OUTPUT_TOKENS = 300
+# Timeout global d'une requête LLM (secondes), au-delà on bascule de modèle
+REQUEST_TIMEOUT = float(os.environ.get("RAG_LLM_TIMEOUT", "120"))
+# Durée pendant laquelle Ollama garde un modèle chargé après une requête
+KEEP_ALIVE = os.environ.get("RAG_KEEP_ALIVE", "30m")
+# Délai avant de re-tester un modèle marqué indisponible (secondes)
+UNHEALTHY_RETRY_AFTER = 60.0
+
+ROUTING_LOG_PATH = Path(os.environ.get("RAG_ROUTING_LOG", "logs/routing.jsonl"))
+
+_log_lock = threading.Lock()
+
+
+def log_event(event: dict, path: Path = ROUTING_LOG_PATH):
+    """Ajoute un évènement (dict) au journal JSONL de routage."""
+    event = {"ts": round(time.time(), 3), **event}
+    try:
+        with _log_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+
+def ollama_request(endpoint: str, payload: dict | None = None, timeout: float = 5.0):
+    """
+    Appel HTTP minimal à l'API Ollama (GET si payload est None, sinon POST JSON).
+    Retourne la réponse JSON décodée.
+    """
+    url = f"{OLLAMA_BASE_URL.rstrip('/')}/{endpoint.lstrip('/')}"
+    data = None
+    headers = {}
+    if payload is not None:
+        data = json.dumps(payload).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(url, data=data, headers=headers)
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def list_local_models(timeout: float = 3.0) -> set:
+    """Noms des modèles disponibles localement dans Ollama."""
+    tags = ollama_request("/api/tags", timeout=timeout)
+    names = set()
+    for m in tags.get("models", []):
+        name = m.get("name") or m.get("model") or ""
+        names.add(name)
+        if name.endswith(":latest"):
+            names.add(name[: -len(":latest")])
+    return names
+
+
+def _prompt_text(prompt) -> str:
+    if hasattr(prompt, "to_string"):
+        return prompt.to_string()
+    if isinstance(prompt, list):
+        return "\n".join(str(getattr(m, "content", m)) for m in prompt)
+    return str(prompt)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation grossière : ~4 caractères par token."""
+    return max(1, len(text) // 4)
+
+
+class ModelStats:
+    """Statistiques observées pour un modèle (vitesse, charge, santé)."""
+
+    # Poids de la moyenne mobile exponentielle des vitesses
+    ALPHA = 0.3
+
+    def __init__(self, name, gen_tps, prompt_tps):
+        self.name = name
+        self.gen_tps = gen_tps
+        self.prompt_tps = prompt_tps
+        self.in_flight = 0
+        self.healthy = True
+        self.unhealthy_since = None
+        self.requests = 0
+        self.errors = 0
+
+    def expected_latency(self, prompt_tokens, output_tokens=EXPECTED_OUTPUT_TOKENS):
+        """Latence estimée (s) en tenant compte des requêtes déjà en cours."""
+        single = prompt_tokens / self.prompt_tps + output_tokens / self.gen_tps
+        return single * (1 + self.in_flight)
+
+    def observe(self, gen_tps=None, prompt_tps=None):
+        if gen_tps:
+            self.gen_tps = (1 - self.ALPHA) * self.gen_tps + self.ALPHA * gen_tps
+        if prompt_tps:
+            self.prompt_tps = (1 - self.ALPHA) * self.prompt_tps + self.ALPHA * prompt_tps
+
+    def mark_unhealthy(self):
+        self.healthy = False
+        self.unhealthy_since = time.time()
+
+    def mark_healthy(self):
+        self.healthy = True
+        self.unhealthy_since = None
+
+    def usable(self):
+        if self.healthy:
+            return True
+        return time.time() - (self.unhealthy_since or 0) > UNHEALTHY_RETRY_AFTER
+
+    def as_dict(self):
+        return {
+            "model": self.name,
+            "healthy": self.healthy,
+            "gen_tps": round(self.gen_tps, 2),
+            "prompt_tps": round(self.prompt_tps, 2),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class ModelRouter:
+    """
+    Route chaque requête vers le modèle dont la latence estimée est la plus
+    faible, et bascule sur le suivant en cas d'erreur ou de timeout.
+    """
+
+    def __init__(self, models=None, temperature=0.2, timeout=REQUEST_TIMEOUT):
+        models = models or CHAT_MODELS
+        self.temperature = temperature
+        self.timeout = timeout
+        self.stats = {
+            name: ModelStats(name, prior["gen_tps"], prior["prompt_tps"])
+            for name, prior in models.items()
+        }
+        self._llms = {}
+        self.last_activity = time.time()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm")
+
+    # ---------- santé ----------
+    def health_check(self):
+        """Vérifie quels modèles configurés sont disponibles dans Ollama."""
+        try:
+            available = list_local_models()
+        except Exception as e:
+            # Serveur injoignable : on ne marque rien, les erreurs réelles
+            # des requêtes feront basculer d'un modèle à l'autre.
+            log_event({"event": "health_check", "error": str(e)})
+            return {name: None for name in self.stats}
+
+        result = {}
+        for name, ms in self.stats.items():
+            ok = name in available
+            if ok:
+                ms.mark_healthy()
+            else:
+                ms.mark_unhealthy()
+            result[name] = ok
+        log_event({"event": "health_check", "models": result})
+        return result
+
+    # ---------- clients LLM ----------
+    def get_llm(self, name):
+        with self._lock:
+            if name not in self._llms:
+                from langchain_community.chat_models import ChatOllama
+
+                self._llms[name] = ChatOllama(
+                    model=name,
+                    base_url=OLLAMA_BASE_URL,
+                    temperature=self.temperature,
+                    keep_alive=KEEP_ALIVE,
+                    # Coupe réellement la requête HTTP (et libère le thread)
+                    # au-delà du délai, au lieu de l'abandonner en arrière-plan
+                    timeout=max(1, int(round(self.timeout))),
+                )
+            return self._llms[name]
+
+    # ---------- routage ----------
+    def rank(self, prompt_tokens):
+        """Modèles triés par latence estimée, modèles indisponibles en dernier."""
+        with self._lock:
+            scored = [
+                (not ms.usable(), ms.expected_latency(prompt_tokens), name)
+                for name, ms in self.stats.items()
+            ]
+        scored.sort()
+        return [(name, latency) for _, latency, name in scored]
+
+    def invoke(self, prompt, config=None, stage="generation"):
+        """
+        Exécute le prompt sur le meilleur modèle, avec fallback.
+        `stage` : étape de profilage (ex. "query_rewrite_llm" pour la
+        reformulation, distincte de la génération de la réponse).
+        """
+        with profile_stage(stage):
+            return self._invoke(prompt)
+
+    def _invoke(self, prompt):
+        self.last_activity = time.time()
+        text = _prompt_text(prompt)
+        prompt_tokens = estimate_tokens(text)
+        ranking = self.rank(prompt_tokens)
+        decision = {
+            "event": "route",
+            "prompt_tokens": prompt_tokens,
+            "ranking": [{"model": n, "expected_s": round(l, 2)} for n, l in ranking],
+            "load": {n: ms.in_flight for n, ms in self.stats.items()},
+            "attempts": [],
+        }
+
+        last_error = None
+        for name, _expected in ranking:
+            attempt = {"model": name}
+            ms = self.stats[name]
+            with self._lock:
+                ms.in_flight += 1
+                ms.requests += 1
+            started = threading.Event()
+            t0 = time.perf_counter()
+            try:
+                future = self._executor.submit(self._call, name, prompt, started)
+            except Exception:
+                with self._lock:
+                    ms.in_flight -= 1
+                raise
+            # L'attente dans la file du pool (autres requêtes en cours) ne compte
+            # pas dans le délai du modèle, et n'est pas une panne du modèle
+            if not started.wait(timeout=self.timeout) and future.cancel():
+                with self._lock:
+                    ms.in_flight -= 1
+                last_error = TimeoutError(f"{name} : file d'attente saturée après {self.timeout:.0f}s")
+                attempt.update(outcome="queued", latency_s=round(time.perf_counter() - t0, 3))
+                decision["attempts"].append(attempt)
+                continue
+            attempt["queued_s"] = round(time.perf_counter() - t0, 3)
+            t0 = time.perf_counter()
+            try:
+                result = future.result(timeout=self.timeout)
+            except FutureTimeout:
+                # Appel lancé depuis plus de self.timeout : il se termine au
+                # timeout HTTP du client, in_flight compté jusque-là (_call)
+                last_error = TimeoutError(f"{name} : pas de réponse après {self.timeout:.0f}s")
+                attempt.update(outcome="timeout", latency_s=round(time.perf_counter() - t0, 3))
+                with self._lock:
+                    ms.errors += 1
+                    ms.mark_unhealthy()
+            except Exception as e:
+                last_error = e
+                attempt.update(outcome="error", error=str(e)[:200],
+                               latency_s=round(time.perf_counter() - t0, 3))
+                with self._lock:
+                    ms.errors += 1
+                    ms.mark_unhealthy()
+            else:
+                elapsed = time.perf_counter() - t0
+                gen_tps, prompt_tps = self._measure(result, elapsed)
+                with self._lock:
+                    ms.observe(gen_tps, prompt_tps)
+                    ms.mark_healthy()
+                attempt.update(outcome="ok", latency_s=round(elapsed, 3),
+                               gen_tps=round(gen_tps or 0, 2))
+                decision["attempts"].append(attempt)
+                decision["chosen"] = name
+                log_event(decision)
+                return result
+            decision["attempts"].append(attempt)
+
+        decision["chosen"] = None
+        log_event(decision)
+        raise RuntimeError(f"Aucun modèle LLM n'a pu répondre : {last_error}")
+
+    def _call(self, name, prompt, started=None):
+        """Appel du modèle ; in_flight n'est décrémenté qu'à la fin réelle de l'appel."""
+        if started is not None:
+            started.set()
+        try:
+            return self.get_llm(name).invoke(prompt)
+        finally:
+            with self._lock:
+                self.stats[name].in_flight -= 1
+
+    @staticmethod
+    def _measure(result, elapsed):
+        """Vitesses (génération, prompt) en tokens/s à partir de la réponse Ollama."""
+        meta = getattr(result, "response_metadata", None) or {}
+        eval_count = meta.get("eval_count")
+        eval_ns = meta.get("eval_duration")
+        prompt_count = meta.get("prompt_eval_count")
+        prompt_ns = meta.get("prompt_eval_duration")
+        gen_tps = eval_count / (eval_ns / 1e9) if eval_count and eval_ns else None
+        prompt_tps = prompt_count / (prompt_ns / 1e9) if prompt_count and prompt_ns else None
+        if gen_tps is None and elapsed > 0:
+            gen_tps = estimate_tokens(str(getattr(result, "content", result))) / elapsed
+        return gen_tps, prompt_tps
+
+    def as_runnable(self):
+        """Le routeur sous forme de Runnable LangChain (remplace un ChatOllama)."""
+        from langchain_core.runnables import RunnableLambda
+
+        return RunnableLambda(self.invoke, name="ModelRouter")
+
+    def snapshot(self):
+        with self._lock:
+            return [ms.as_dict() for ms in self.stats.values()]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def peek_router():
+    """Routeur partagé s'il existe déjà, sans le créer (ni health-check)."""
+    return _router
+
+
+def get_router() -> ModelRouter:
+    """Routeur partagé par le processus (health-check à la première création)."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+            _router.health_check()
+        return _router
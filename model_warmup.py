@@ -0,0 +1,127 @@
+# model_warmup.py
+"""
+Préchauffage et maintien en mémoire des modèles Ollama.
+
+- Au démarrage : petites requêtes pour charger le modèle d'embeddings et le
+  modèle de chat, avec un keep_alive explicite.
+- Mesure de la latence du premier token à froid puis à chaud.
+- Heartbeat en arrière-plan tant que l'application est utilisée.
+"""
+import os
+import json
+import time
+import threading
+import urllib.request
+
+from model_router import KEEP_ALIVE, OLLAMA_BASE_URL, get_router, log_event, ollama_request
+
+EMBED_MODEL = "nomic-embed-text"
+# Intervalle du heartbeat (s) : doit rester inférieur au keep_alive par défaut
+# d'Ollama (5 min), que rétablit toute requête sans keep_alive explicite.
+HEARTBEAT_INTERVAL = float(os.environ.get("RAG_HEARTBEAT_INTERVAL", "120"))
+# Au-delà de cette inactivité (s), le heartbeat laisse Ollama décharger les modèles
+IDLE_STOP_AFTER = float(os.environ.get("RAG_IDLE_STOP_AFTER", "1800"))
+
+# Rapport de préchauffage (affiché dans l'instrumentation de l'app)
+WARMUP_REPORT = {"status": "pending", "models": {}}
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def _first_token_latency(model: str, timeout: float = 120.0) -> float:
+    """Temps (s) jusqu'au premier token d'une génération d'un seul token."""
+    payload = {
+        "model": model,
+        "prompt": "OK",
+        "stream": True,
+        "keep_alive": KEEP_ALIVE,
+        "options": {"num_predict": 1},
+    }
+    url = f"{OLLAMA_BASE_URL.rstrip('/')}/api/generate"
+    req = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        first = None
+        for line in resp:
+            if first is None and line.strip():
+                first = time.perf_counter() - t0
+        return first if first is not None else time.perf_counter() - t0
+
+
+def _embed_latency(model: str, timeout: float = 120.0) -> float:
+    t0 = time.perf_counter()
+    ollama_request(
+        "/api/embeddings",
+        {"model": model, "prompt": "warm-up", "keep_alive": KEEP_ALIVE},
+        timeout=timeout,
+    )
+    return time.perf_counter() - t0
+
+
+def warm_up(chat_model: str | None = None, embed_model: str = EMBED_MODEL):
+    """
+    Charge les modèles (embeddings + chat) et mesure la latence à froid
+    (premier appel, chargement compris) puis à chaud (second appel).
+    """
+    router = get_router()
+    chat_model = chat_model or router.rank(0)[0][0]
+    WARMUP_REPORT["status"] = "running"
+
+    for kind, model, probe in (
+        ("embeddings", embed_model, _embed_latency),
+        ("chat", chat_model, _first_token_latency),
+    ):
+        entry = {"kind": kind, "keep_alive": KEEP_ALIVE}
+        try:
+            entry["cold_s"] = round(probe(model), 3)
+            entry["warm_s"] = round(probe(model), 3)
+        except Exception as e:
+            entry["error"] = str(e)[:200]
+        WARMUP_REPORT["models"][model] = entry
+        log_event({"event": "warmup", "model": model, **entry})
+
+    WARMUP_REPORT["status"] = "done"
+    WARMUP_REPORT["finished_at"] = time.time()
+    return WARMUP_REPORT
+
+
+def _heartbeat_loop(embed_model: str):
+    router = get_router()
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        if time.time() - router.last_activity > IDLE_STOP_AFTER:
+            continue
+        models = [m for m, _ in router.rank(0) if router.stats[m].healthy][:1]
+        try:
+            ollama_request(
+                "/api/embeddings",
+                {"model": embed_model, "prompt": "ping", "keep_alive": KEEP_ALIVE},
+                timeout=60,
+            )
+            for m in models:
+                # Prompt vide : charge / maintient le modèle sans générer
+                ollama_request(
+                    "/api/generate", {"model": m, "prompt": "", "keep_alive": KEEP_ALIVE},
+                    timeout=60,
+                )
+        except Exception as e:
+            log_event({"event": "heartbeat", "error": str(e)[:200]})
+
+
+def start_warmup(embed_model: str = EMBED_MODEL):
+    """Lance (une seule fois par processus) le préchauffage puis le heartbeat."""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+
+    def run():
+        warm_up(embed_model=embed_model)
+        _heartbeat_loop(embed_model)
+
+    threading.Thread(target=run, name="ollama-warmup", daemon=True).start()
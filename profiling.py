@@ -0,0 +1,248 @@
+# profiling.py
+"""
+Profilage à la demande (cProfile + tracemalloc) de l'ingestion et des requêtes.
+
+Activation : variable d'environnement RAG_PROFILE=1 ou set_enabled(True)
+pour tout le processus, ou profile_run(nom, enabled=True) pour une seule
+exécution (case à cocher de l'app, propre à chaque session). Désactivé,
+chaque point de mesure se réduit à un test de booléen.
+
+- profile_run(nom)   : une exécution complète (build_index, une question…)
+- profile_stage(nom) : une étape dans l'exécution en cours (chargement,
+  découpage, embeddings, récupération, génération…)
+
+Chaque exécution écrit dans PROFILE_DIR/<horodatage>-<nom>/ :
+profile.prof (pstats), summary.txt (étapes, fonctions les plus coûteuses,
+pic mémoire, principales allocations). Seules les KEEP_RUNS dernières
+exécutions sont conservées ; index.jsonl garde un résumé de chacune.
+
+L'exécution en cours est portée par une ContextVar : seules les étapes
+lancées dans son contexte (y compris les threads où LangChain copie le
+contexte) s'y rattachent, pas celles des autres sessions.
+"""
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import shutil
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+PROFILE_DIR = Path(os.environ.get("RAG_PROFILE_DIR", "profiles"))
+KEEP_RUNS = int(os.environ.get("RAG_PROFILE_KEEP", "20"))
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 15
+
+_enabled = os.environ.get("RAG_PROFILE", "0") == "1"
+# Exécution profilée du processus (cProfile / tracemalloc : une à la fois)
+_active = None
+# Exécution à laquelle appartient le contexte courant
+_current_run = contextvars.ContextVar("rag_profile_run", default=None)
+_lock = threading.Lock()
+
+
+def set_enabled(flag: bool):
+    global _enabled
+    _enabled = bool(flag)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _profiling() -> bool:
+    """Vrai si le profilage est actif (global, ou exécution profilée en cours)."""
+    return _enabled or _active is not None
+
+
+def _start_profiler():
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        # Un autre profileur est déjà actif (Python ≥ 3.12 : un seul à la fois)
+        return None
+    return prof
+
+
+class _Run:
+    def __init__(self, name):
+        self.name = name
+        self.thread = threading.get_ident()
+        self.started = time.perf_counter()
+        self.stages = []
+        self.profilers = []
+        self.peak = 0
+
+
+@contextmanager
+def profile_run(name: str, enabled=None):
+    """
+    Profile une exécution complète ; imbriquée, elle devient une étape.
+    `enabled` : force l'activation pour cette exécution (défaut : réglage global).
+    """
+    global _active
+    if not (_enabled if enabled is None else enabled):
+        yield
+        return
+    with _lock:
+        current = _active
+        if current is None:
+            run = _active = _Run(name)
+    if current is not None:
+        if _current_run.get() is current:
+            with profile_stage(name):
+                yield
+        else:
+            # Exécution concurrente (autre utilisateur) : non profilée
+            yield
+        return
+
+    token = _current_run.set(run)
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(10)
+    tracemalloc.reset_peak()
+    prof = _start_profiler()
+    try:
+        yield
+    finally:
+        if prof is not None:
+            prof.disable()
+            run.profilers.insert(0, prof)
+        run.peak = max(run.peak, tracemalloc.get_traced_memory()[1])
+        snapshot = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+        _current_run.reset(token)
+        with _lock:
+            _active = None
+        try:
+            _write_report(run, time.perf_counter() - run.started, snapshot)
+        except OSError as e:
+            print(f"⚠️ [WARN] Rapport de profilage non écrit : {e}")
+
+
+@contextmanager
+def profile_stage(name: str):
+    """Mesure une étape (durée, pic mémoire) dans l'exécution en cours."""
+    if not _profiling():
+        yield
+        return
+    run = _current_run.get()
+    if run is None or run is not _active:
+        # Hors de toute exécution profilée (ou dans celle d'une autre session) :
+        # étape autonome si le profilage global est actif, sinon rien
+        if not _enabled or _active is not None:
+            yield
+            return
+        with profile_run(name):
+            yield
+        return
+
+    # Étape exécutée dans un autre thread (ex. branches parallèles LangChain) :
+    # profileur dédié, fusionné dans le rapport de l'exécution.
+    prof = _start_profiler() if threading.get_ident() != run.thread else None
+    if tracemalloc.is_tracing():
+        # Conserve le pic atteint avant l'étape, puis mesure celui de l'étape
+        run.peak = max(run.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        if prof is not None:
+            prof.disable()
+        with _lock:
+            run.peak = max(run.peak, peak)
+            run.stages.append({"stage": name, "wall_s": round(wall, 4),
+                               "peak_mb": round(peak / 1e6, 2)})
+            if prof is not None:
+                run.profilers.append(prof)
+
+
+def profiled(name: str):
+    """Décorateur : la fonction devient une étape (ou une exécution)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _profiling():
+                return func(*args, **kwargs)
+            with profile_stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _write_report(run, wall, snapshot):
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    out = PROFILE_DIR / f"{stamp}-{run.name}"
+    out.mkdir(parents=True, exist_ok=True)
+
+    lines = [
+        f"Exécution : {run.name}",
+        f"Date : {datetime.now().isoformat(timespec='seconds')}",
+        f"Durée totale : {wall:.3f} s",
+        f"Pic mémoire Python (tracemalloc) : {run.peak / 1e6:.2f} Mo",
+        "",
+        "Étapes :",
+    ]
+    for st in run.stages:
+        lines.append(f"  {st['stage']:<24} {st['wall_s']:>9.3f} s   pic {st['peak_mb']:>8.2f} Mo")
+
+    if run.profilers:
+        stats = pstats.Stats(run.profilers[0])
+        for extra in run.profilers[1:]:
+            stats.add(extra)
+        stats.dump_stats(out / "profile.prof")
+        buf = io.StringIO()
+        report = pstats.Stats(str(out / "profile.prof"), stream=buf)
+        report.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        lines += ["", f"Fonctions les plus coûteuses (cumulé, top {TOP_FUNCTIONS}) :", buf.getvalue()]
+
+    lines += ["", f"Principales allocations (top {TOP_ALLOCATIONS}) :"]
+    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+        lines.append(f"  {stat}")
+
+    (out / "summary.txt").write_text("\n".join(lines), encoding="utf-8")
+    with (PROFILE_DIR / "index.jsonl").open("a", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "run": out.name, "name": run.name, "wall_s": round(wall, 4),
+            "peak_mb": round(run.peak / 1e6, 2), "stages": run.stages,
+        }, ensure_ascii=False) + "\n")
+    _rotate()
+    return out
+
+
+def _rotate():
+    runs = sorted(p for p in PROFILE_DIR.iterdir() if p.is_dir())
+    excess = len(runs) - max(KEEP_RUNS, 1)
+    for old in runs[:max(excess, 0)]:
+        shutil.rmtree(old, ignore_errors=True)
+    # index.jsonl : seulement les exécutions dont le dossier existe encore
+    index = PROFILE_DIR / "index.jsonl"
+    kept = {p.name for p in runs[max(excess, 0):]}
+    lines = index.read_text(encoding="utf-8").splitlines()
+    lines = [line for line in lines if line.strip() and json.loads(line).get("run") in kept]
+    tmp = index.with_suffix(".jsonl.part")
+    tmp.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+    tmp.replace(index)
+
+
+def latest_runs(n=5):
+    """Résumés des n dernières exécutions profilées (depuis index.jsonl)."""
+    index = PROFILE_DIR / "index.jsonl"
+    if not index.exists():
+        return []
+    lines = index.read_text(encoding="utf-8").splitlines()[-n:]
+    return [json.loads(line) for line in reversed(lines) if line.strip()]
@@ -0,0 +1,152 @@
+# quantization.py
+"""
+Stockage quantifié (int8 scalaire) des embeddings pour la recherche.
+
+Chaque dimension est ramenée sur 256 niveaux (min/max par dimension) :
+le scan lit 1 octet par composante au lieu de 4 (codes ouverts en mmap,
+produits matriciels par blocs). Les meilleurs candidats sont ensuite
+re-classés avec les vecteurs exacts (float32), gardés dans un fichier
+séparé lui aussi ouvert en mmap : seules les lignes des candidats sont lues,
+et l'index HNSW de Chroma n'est pas chargé sur ce chemin.
+
+C'est une optimisation de la vitesse du scan, pas de la place : Chroma
+garde ses propres vecteurs, les fichiers int8 et exacts s'y ajoutent sur
+le disque. En mémoire, seul le scan int8 est résident (voir memory_report).
+"""
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+QUANT_DIR = "quantized"
+# Lignes traitées par bloc lors du scan (borne la mémoire temporaire)
+SCAN_BLOCK = 16384
+
+
+def quant_dir(db_dir) -> Path:
+    return Path(db_dir) / QUANT_DIR
+
+
+class Int8Index:
+    """
+    Index int8 : codes (n, d), paramètres de dé-quantification, normes et
+    vecteurs exacts (re-classement).
+    """
+
+    def __init__(self, ids, codes, scale, offset, sqnorms, exact=None):
+        self.ids = list(ids)
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+        self.sqnorms = sqnorms
+        self.exact = exact
+        self._row_of = {cid: i for i, cid in enumerate(self.ids)}
+
+    # ---------- construction ----------
+    @classmethod
+    def build(cls, ids, vectors):
+        x = np.asarray(vectors, dtype=np.float32)
+        lo = x.min(axis=0)
+        hi = x.max(axis=0)
+        scale = np.maximum(hi - lo, 1e-12) / 255.0
+        codes = (np.rint((x - lo) / scale) - 128).clip(-128, 127).astype(np.int8)
+        # x ≈ offset + scale * code, avec offset = lo + 128 * scale
+        offset = (lo + 128.0 * scale).astype(np.float32)
+        sqnorms = np.einsum("ij,ij->i", x, x).astype(np.float32)
+        return cls(ids, codes, scale.astype(np.float32), offset, sqnorms, exact=x)
+
+    def save(self, db_dir):
+        out = quant_dir(db_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        np.save(out / "codes.npy", self.codes)
+        if self.exact is not None:
+            np.save(out / "exact.npy", np.asarray(self.exact, dtype=np.float32))
+        np.savez(out / "params.npz", scale=self.scale, offset=self.offset, sqnorms=self.sqnorms)
+        (out / "ids.json").write_text(json.dumps(self.ids), encoding="utf-8")
+
+    @classmethod
+    def load(cls, db_dir, mmap=True):
+        """Charge l'index (codes en mmap) ou retourne None s'il n'existe pas."""
+        d = quant_dir(db_dir)
+        if not (d / "codes.npy").exists():
+            return None
+        codes = np.load(d / "codes.npy", mmap_mode="r" if mmap else None)
+        params = np.load(d / "params.npz")
+        ids = json.loads((d / "ids.json").read_text(encoding="utf-8"))
+        exact = None
+        if (d / "exact.npy").exists():
+            exact = np.load(d / "exact.npy", mmap_mode="r" if mmap else None)
+        return cls(ids, codes, params["scale"], params["offset"], params["sqnorms"], exact=exact)
+
+    @staticmethod
+    def remove(db_dir):
+        shutil.rmtree(quant_dir(db_dir), ignore_errors=True)
+
+    # ---------- recherche ----------
+    def candidates(self, query_vec, n, allowed_ids=None):
+        """
+        IDs des n plus proches voisins approximés (distance L2, comme la
+        collection Chroma) : ||q - x||² = ||q||² - 2 q·x + ||x||².
+        """
+        q = np.asarray(query_vec, dtype=np.float32)
+        q_scaled = q * self.scale
+        q_off = float(q @ self.offset)
+
+        rows = None
+        if allowed_ids is not None:
+            rows = np.fromiter(
+                (self._row_of[c] for c in allowed_ids if c in self._row_of), dtype=np.int64
+            )
+            if rows.size == 0:
+                return []
+
+        total = len(self.ids) if rows is None else rows.size
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, SCAN_BLOCK):
+            sel = slice(start, start + SCAN_BLOCK)
+            block = self.codes[sel] if rows is None else self.codes[rows[sel]]
+            dots = block.astype(np.float32) @ q_scaled + q_off
+            norms = self.sqnorms[sel] if rows is None else self.sqnorms[rows[sel]]
+            scores[sel] = norms - 2.0 * dots
+
+        n = min(n, total)
+        top = np.argpartition(scores, n - 1)[:n]
+        top = top[np.argsort(scores[top])]
+        if rows is not None:
+            top = rows[top]
+        return [self.ids[i] for i in top]
+
+    def rescore(self, query_vec, cand_ids, k):
+        """Les k meilleurs candidats selon la distance L2 exacte (lignes lues en mmap)."""
+        rows = np.fromiter((self._row_of[c] for c in cand_ids if c in self._row_of), dtype=np.int64)
+        if rows.size == 0:
+            return []
+        rows.sort()  # lecture séquentielle du fichier mmap
+        q = np.asarray(query_vec, dtype=np.float32)
+        dist = ((np.asarray(self.exact[rows], dtype=np.float32) - q) ** 2).sum(axis=1)
+        return [self.ids[rows[i]] for i in np.argsort(dist)[:k]]
+
+    def memory_report(self, rescore_k=0):
+        """
+        Empreinte réelle de l'index, en plus de celle de Chroma :
+        - disk_delta_bytes : octets ajoutés sur disque (codes + vecteurs exacts) ;
+        - resident_bytes : octets résidents en mémoire (le scan lit tous les
+          codes à chaque requête, le re-classement rescore_k lignes exactes) ;
+        - float32_bytes : vecteurs float32 que Chroma charge (index HNSW) si
+          sa recherche est utilisée — aucune mémoire n'est économisée sinon.
+        """
+        n, d = self.codes.shape
+        int8_bytes = self.codes.nbytes + self.scale.nbytes + self.offset.nbytes + self.sqnorms.nbytes
+        exact_bytes = n * d * 4 if self.exact is not None else 0
+        return {
+            "vectors": n,
+            "dim": d,
+            "int8_bytes": int8_bytes,
+            "exact_bytes": exact_bytes,
+            "disk_delta_bytes": int8_bytes + exact_bytes,
+            "resident_bytes": int8_bytes + min(rescore_k, n) * d * 4,
+            "float32_bytes": n * d * 4,
+            # Octets parcourus par requête : scan int8 vs scan float32 complet
+            "scan_ratio": (n * d * 4) / int8_bytes if int8_bytes else 0.0,
+        }
@@ -0,0 +1,310 @@
+# query_rewriter.py
+"""
+Reformulation des questions de suivi en requêtes de recherche autonomes.
+
+« et ses applications ? » ne retrouve rien seule : on la complète avec le
+sujet des derniers échanges de la conversation avant la recherche.
+
+- Question autonome (cas le plus fréquent) : utilisée telle quelle, coût nul.
+- Question de suivi : heuristique (mots-clés de la dernière question
+  autonome + question courante), sans appel LLM.
+- Référence au contenu d'une réponse (« le deuxième point », « cette
+  méthode »…) : condensation par le petit LLM (routeur), avec un budget de
+  temps ; l'embedding de la requête heuristique est calculé pendant ce temps
+  et sert de repli.
+
+Les reformulations sont mises en cache par (session, tour).
+"""
+import contextvars
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from chat_search import STOPWORDS, normalize
+from profiling import profile_stage
+
+# "auto" (heuristique puis LLM si besoin), "heuristic" (jamais de LLM) ou "off"
+REWRITE_MODE = os.environ.get("RAG_REWRITE_MODE", "auto")
+# Budget (s) accordé au LLM avant repli sur la reformulation heuristique
+REWRITE_TIMEOUT = float(os.environ.get("RAG_REWRITE_TIMEOUT", "8"))
+# Nombre d'échanges (question + réponse) pris en compte
+HISTORY_TURNS = 3
+# Troncature des réponses envoyées au LLM
+MAX_ANSWER_CHARS = 600
+MAX_KEYWORDS = 8
+CACHE_SIZE = 1024
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Mots outils des questions, en plus des mots vides de la recherche
+QUESTION_WORDS = STOPWORDS | {
+    "quoi", "quel", "quelle", "quels", "quelles", "comment", "pourquoi", "combien",
+    "quand", "ou", "qu", "ce", "cet", "cette", "ces", "est", "sont", "peux", "peut",
+    "explique", "expliquer", "donne", "donner", "moi", "plus", "sur", "avec", "sans",
+    "what", "how", "why", "when", "which", "who", "are", "can", "you", "me", "about",
+}
+# Début typique d'une question de suivi
+FOLLOWUP_START = {"et", "mais", "aussi", "alors", "puis", "ensuite", "sinon", "and", "also"}
+# Pronoms / possessifs renvoyant au sujet précédent (sans le « il »
+# impersonnel : « Y a-t-il… », « Combien faut-il… »)
+ANAPHORA = {
+    "elle", "ils", "elles", "ses", "son", "sa", "leur", "leurs", "lui", "ca",
+    "cela", "celui", "celle", "ceux", "celles", "it", "its", "they", "them", "their",
+}
+# Déterminants démonstratifs et ordinaux : « cette méthode », « le deuxième
+# point »… ne renvoient à la réponse précédente qu'avec un nom qu'elle contient
+DEMONSTRATIVES = {"ce", "cet", "cette", "ces", "this", "that", "these", "those"}
+ORDINALS = {
+    "premier", "premiere", "deuxieme", "second", "seconde", "troisieme", "dernier",
+    "derniere", "precedent", "precedente", "former", "latter", "previous",
+}
+
+CONDENSE_PROMPT = (
+    "Voici la fin d'une conversation entre un utilisateur et un assistant, puis "
+    "une nouvelle question de l'utilisateur.\n"
+    "Reformule la nouvelle question en une question autonome, compréhensible "
+    "sans la conversation, dans la même langue. Réponds uniquement par la question.\n\n"
+    "CONVERSATION :\n{conversation}\n\n"
+    "NOUVELLE QUESTION : {question}\n\n"
+    "QUESTION AUTONOME :"
+)
+
+
+def words(text):
+    """Mots normalisés (minuscules, sans accents)."""
+    return [normalize(m.group()) for m in _WORD_RE.finditer(text or "")]
+
+
+def keywords(text, limit=MAX_KEYWORDS):
+    """Mots porteurs de sens d'un texte, forme d'origine, sans doublons."""
+    out, seen = [], set()
+    for m in _WORD_RE.finditer(text or ""):
+        norm = normalize(m.group())
+        if len(norm) > 2 and norm not in QUESTION_WORDS and norm not in seen:
+            seen.add(norm)
+            out.append(m.group())
+            if len(out) >= limit:
+                break
+    return out
+
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+def last_answer(history):
+    return next(
+        (m["content"] for m in reversed(history or []) if m.get("role") != "user" and m.get("content")),
+        "",
+    )
+
+
+def refers_to_answer(question, history) -> bool:
+    """
+    Renvoi au contenu de la dernière réponse : démonstratif ou ordinal suivi
+    (ou précédé, « le point précédent ») d'un nom présent dans cette réponse.
+    « Quel est le point fort des SVM ? » ou « la dernière version de Python »
+    n'en sont pas si la réponse ne parle ni de point ni de version.
+    """
+    answer = {_stem(w) for w in words(last_answer(history))}
+    if not answer:
+        return False
+    toks = words(question)
+    for i, tok in enumerate(toks):
+        if tok not in DEMONSTRATIVES and tok not in ORDINALS:
+            continue
+        around = toks[i + 1:i + 3] + (toks[i - 1:i] if tok in ORDINALS else [])
+        for noun in around:
+            if (len(noun) > 2 and noun not in QUESTION_WORDS and noun not in ORDINALS
+                    and _stem(noun) in answer):
+                return True
+    return False
+
+
+def is_followup(question, history=None) -> bool:
+    """
+    Question qui dépend des échanges précédents : conjonction initiale,
+    pronom de reprise ou renvoi à la dernière réponse. Une question courte
+    (« C'est quoi Python ? ») n'est pas pour autant une question de suivi.
+    """
+    toks = words(question)
+    if not toks:
+        return False
+    return bool(
+        toks[0] in FOLLOWUP_START or ANAPHORA.intersection(toks)
+        or refers_to_answer(question, history)
+    )
+
+
+def recent_turns(history, turns=HISTORY_TURNS):
+    """Derniers échanges (messages) de l'historique, hors messages vides."""
+    msgs = [m for m in history or [] if m.get("content")]
+    return msgs[-2 * turns:]
+
+
+def topic_of(history):
+    """
+    Sujet courant : la dernière question autonome de l'historique récent
+    (sinon la reformulation de la dernière question de suivi).
+    """
+    user_msgs = [m for m in recent_turns(history) if m.get("role") == "user"]
+    for msg in reversed(user_msgs):
+        if not is_followup(msg["content"]):
+            return msg["content"]
+    if user_msgs:
+        return user_msgs[-1].get("search_query") or user_msgs[-1]["content"]
+    return ""
+
+
+def heuristic_rewrite(question, history):
+    """Mots-clés du sujet courant + question (ou None si rien à ajouter)."""
+    q_norm = set(words(question))
+    extra = [w for w in keywords(topic_of(history)) if normalize(w) not in q_norm]
+    if not extra:
+        return None
+    return f"{' '.join(extra)} — {question}"
+
+
+class QueryRewriter:
+    """Reformulation heuristique / LLM des questions de suivi, avec cache."""
+
+    def __init__(self, llm=None, mode=REWRITE_MODE, timeout=REWRITE_TIMEOUT,
+                 cache_size=CACHE_SIZE):
+        self._llm = llm
+        self.mode = mode
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (session_id, tour, question) -> requête
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rewrite")
+
+    # ---------- cache ----------
+    def _cache_get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def _cache_put(self, key, query):
+        with self._lock:
+            self._cache[key] = query
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---------- reformulation ----------
+    def plan(self, question, history):
+        """
+        Retourne (requête, besoin_llm) : requête heuristique (ou la question
+        elle-même) et s'il faut tenter la condensation par LLM.
+        """
+        if self.mode == "off" or not recent_turns(history) or not is_followup(question, history):
+            return question, False
+        query = heuristic_rewrite(question, history) or question
+        needs_llm = self.mode == "auto" and (
+            query == question or refers_to_answer(question, history)
+        )
+        return query, needs_llm
+
+    def condense(self, question, history):
+        """Question autonome via le LLM (routeur : modèle le plus rapide)."""
+        lines = []
+        for msg in recent_turns(history):
+            text = msg["content"]
+            if msg.get("role") != "user":
+                text = text[:MAX_ANSWER_CHARS]
+            lines.append(f"{'Utilisateur' if msg.get('role') == 'user' else 'Assistant'} : {text}")
+        prompt = CONDENSE_PROMPT.format(conversation="\n".join(lines), question=question)
+        if self._llm is None:
+            from model_router import get_router
+            # Étape de profilage propre, distincte de la génération de la réponse
+            result = get_router().invoke(prompt, stage="query_rewrite_llm")
+        else:
+            result = self._llm.invoke(prompt)
+        text = getattr(result, "content", result).strip()
+        # Première ligne non vide, sans guillemets ni préfixe
+        text = next((line for line in text.splitlines() if line.strip()), "")
+        text = re.sub(r"^(question autonome\s*:)\s*", "", text.strip(), flags=re.I)
+        return text.strip(" \"'«»")
+
+    def resolve(self, inputs, embed):
+        """
+        Requête de recherche et son embedding pour une entrée de la chaîne
+        {"question", "history"?, "session_id"?, "turn"?}.
+
+        L'embedding de la requête heuristique est calculé pendant l'appel au
+        LLM ; il est réutilisé si le LLM échoue, dépasse son budget ou
+        renvoie la même requête.
+        """
+        question = inputs["question"]
+        history = inputs.get("history") or []
+        key = None
+        if inputs.get("session_id") is not None and inputs.get("turn") is not None:
+            key = (inputs["session_id"], inputs["turn"], question)
+            cached = self._cache_get(key)
+            if cached is not None:
+                with profile_stage("query_embedding"):
+                    return cached, embed(cached)
+
+        query, needs_llm = self.plan(question, history)
+        future = None
+        if needs_llm:
+            # Contexte copié : l'appel LLM reste rattaché au profilage de la question
+            future = self._executor.submit(
+                contextvars.copy_context().run, self.condense, question, history
+            )
+        with profile_stage("query_embedding"):
+            query_vec = embed(query)
+
+        if future is not None:
+            with profile_stage("query_rewrite"):
+                try:
+                    condensed = future.result(timeout=self.timeout)
+                except FutureTimeout:
+                    future.cancel()
+                    print(f"⚠️ [WARN] Reformulation LLM > {self.timeout:.0f}s : requête heuristique utilisée.")
+                    condensed = None
+                except Exception as e:
+                    print(f"⚠️ [WARN] Reformulation LLM impossible : {e}")
+                    condensed = None
+            if condensed and condensed != query:
+                query = condensed
+                with profile_stage("query_embedding"):
+                    query_vec = embed(query)
+
+        if key is not None:
+            self._cache_put(key, query)
+        return query, query_vec
+
+
+def _self_check():
+    """Cas de référence de la détection (python query_rewriter.py)."""
+    history = [
+        {"role": "user", "content": "Qu'est-ce que le deep learning ?"},
+        {"role": "assistant", "content": "Le deep learning empile des couches de neurones. "
+                                         "Deux méthodes : la rétropropagation et le dropout."},
+    ]
+    rewriter = QueryRewriter(llm=object(), mode="auto")
+    standalone = [
+        "Combien de couches faut-il dans un CNN ?",
+        "Y a-t-il une différence entre SVM et forêts aléatoires ?",
+        "Donne un exemple de réseau convolutif",
+        "Quel est le point fort des SVM ?",
+        "Quelle est la dernière version de Python ?",
+        "C'est quoi Python ?",
+        "Qu'est-ce que la rétropropagation ?",
+    ]
+    for q in standalone:
+        assert rewriter.plan(q, history) == (q, False), q
+    query, needs_llm = rewriter.plan("et ses applications ?", history)
+    assert query.startswith("deep learning") and not needs_llm, query
+    assert rewriter.plan("Explique la deuxième méthode", history)[1]
+    assert rewriter.plan("Et cette méthode, comment marche-t-elle ?", history)[1]
+    print("✅ Détection des questions de suivi : OK")
+
+
+if __name__ == "__main__":
+    _self_check()
@@ -1,16 +1,42 @@
 import os
 os.environ["OLLAMA_NUM_GPU"] = "0"
 
+import json
+from operator import itemgetter
+
 from langchain.prompts import ChatPromptTemplate
-from langchain_community.chat_models import ChatOllama
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
-from langchain.schema.runnable import RunnablePassthrough
+from langchain.schema.runnable import RunnableLambda, RunnablePassthrough
 from langchain.schema.output_parser import StrOutputParser
+from langchain.schema import Document
+
+from model_router import get_router
+from model_warmup import start_warmup
+from source_index import (
+    chunk_ids_for,
+    chunk_ids_for_docs, doc_filter, doc_id_for, load_source_index, source_index_path,
+)
+from quantization import Int8Index, quant_dir
+from profiling import profile_stage
+from query_rewriter import QueryRewriter
 
 # Dossier où Chroma va stocker les embeddings
 DB_DIR = "chroma"  # simplifié pour correspondre à ton app.py
 
+# Collection des vecteurs « document » (index de premier niveau)
+DOC_COLLECTION = "rag_documents"
+# Mode de recherche : "flat" (tous les chunks), "two_stage" (documents puis
+# chunks) ou "auto" (deux temps dès que le corpus dépasse TWO_STAGE_MIN_DOCS)
+RETRIEVAL_MODE = os.environ.get("RAG_RETRIEVAL_MODE", "auto")
+TWO_STAGE_MIN_DOCS = int(os.environ.get("RAG_TWO_STAGE_MIN_DOCS", "20"))
+# Nombre de documents retenus au premier niveau
+STAGE1_DOCS = int(os.environ.get("RAG_STAGE1_DOCS", "4"))
+# Scan de l'index int8 (si construit avec build_index(quantize=True)) au lieu
+# de la recherche plate Chroma ; candidats re-classés avec les vecteurs exacts
+USE_QUANTIZED = os.environ.get("RAG_QUANTIZED_SEARCH", "1") == "1"
+RESCORE_FACTOR = int(os.environ.get("RAG_RESCORE_FACTOR", "4"))
+
 # ===============================
 # 🧠 SYSTEM PROMPT : contexte
 # ===============================
@@ -29,47 +55,273 @@ Réponse:"""
 # ===============================
 # 🔎 RÉCUPÉRATION (RETRIEVER)
 # ===============================
-def make_retriever(db_dir=DB_DIR, k=3):
+def make_vectorstore(db_dir=DB_DIR):
+    """Ouvre l'index Chroma avec les embeddings Ollama (nomic-embed-text)."""
+    embeddings = OllamaEmbeddings(model="nomic-embed-text")
+    return Chroma(persist_directory=db_dir, embedding_function=embeddings)
+
+
+def source_filter(sources=None):
     """
-    Crée un retriever basé sur les embeddings Ollama (nomic-embed-text).
+    Filtre Chroma (where) limitant la recherche des chunks à certains
+    documents, y compris les chunks fusionnés dans ceux d'un autre document.
+    `sources` : chemins tels qu'enregistrés dans source_index.json.
     """
-    embeddings = OllamaEmbeddings(model="nomic-embed-text")
-    vectordb = Chroma(persist_directory=db_dir, embedding_function=embeddings)
-    return vectordb.as_retriever(search_kwargs={"k": k})
+    if not sources:
+        return None
+    return doc_filter(doc_id_for(src) for src in sources)
+
+
+def document_filter(sources=None):
+    """Filtre (where) de la collection des documents (une entrée par source)."""
+    if not sources:
+        return None
+    sources = list(sources)
+    if len(sources) == 1:
+        return {"source": sources[0]}
+    return {"source": {"$in": sources}}
+
+
+def make_retriever(db_dir=DB_DIR, k=3, sources=None):
+    """
+    Crée un retriever basé sur les embeddings Ollama (nomic-embed-text),
+    éventuellement restreint à une liste de documents.
+    """
+    vectordb = make_vectorstore(db_dir)
+    search_kwargs = {"k": k}
+    where = source_filter(sources)
+    if where:
+        search_kwargs["filter"] = where
+    return vectordb.as_retriever(search_kwargs=search_kwargs)
+
+
+def open_doc_collection(db_dir=DB_DIR):
+    """Collection des vecteurs de documents, ou None si absente / vide."""
+    import chromadb
+    client = chromadb.PersistentClient(db_dir)
+    try:
+        col = client.get_collection(DOC_COLLECTION)
+    except Exception:
+        return None
+    return col if col.count() else None
+
+
+def search_flat(vectordb, query_vec, k=3, where=None):
+    """Recherche k-NN sur l'ensemble des chunks."""
+    return vectordb.similarity_search_by_vector(query_vec, k=k, filter=where)
+
+
+def search_two_stage(vectordb, doc_col, query_vec, k=3, n_docs=STAGE1_DOCS, sources=None,
+                     qindex=None, src_index=None):
+    """
+    Recherche en deux temps : les n_docs documents les plus proches (vecteurs
+    moyens), puis les k meilleurs chunks de ces documents uniquement — via
+    le scan int8 restreint à leurs chunks si `qindex` est fourni, sinon via
+    Chroma.
+    """
+    res = doc_col.query(
+        query_embeddings=[query_vec],
+        n_results=max(1, min(n_docs, doc_col.count())),
+        where=document_filter(sources),
+        include=[],
+    )
+    doc_ids = res["ids"][0]
+    if not doc_ids:
+        return []
+    if qindex is not None:
+        allowed = chunk_ids_for_docs(src_index, doc_ids)
+        return search_quantized(vectordb, qindex, query_vec, k=k, allowed_ids=allowed)
+    return vectordb.similarity_search_by_vector(query_vec, k=k, filter=doc_filter(doc_ids))
+
+
+def search_quantized(vectordb, qindex, query_vec, k=3, rescore_k=None, allowed_ids=None):
+    """
+    Scan vectorisé de l'index int8, puis re-classement des rescore_k
+    meilleurs candidats avec les vecteurs exacts de l'index (mmap) : seuls
+    textes et métadonnées sont lus dans Chroma, sans charger son index HNSW.
+    Index construit avant l'ajout des vecteurs exacts : ceux de Chroma.
+    """
+    import numpy as np
+
+    cand_ids = qindex.candidates(query_vec, rescore_k or k * RESCORE_FACTOR, allowed_ids)
+    if not cand_ids:
+        return []
+    if qindex.exact is not None:
+        top = qindex.rescore(query_vec, cand_ids, k)
+        got = vectordb._collection.get(ids=top, include=["documents", "metadatas"])
+        pos = {cid: i for i, cid in enumerate(got["ids"])}
+        return [
+            Document(page_content=got["documents"][pos[cid]], metadata=got["metadatas"][pos[cid]] or {})
+            for cid in top if cid in pos
+        ]
+    got = vectordb._collection.get(ids=cand_ids, include=["embeddings", "documents", "metadatas"])
+    if not got["ids"]:
+        return []
+    exact = np.asarray(got["embeddings"], dtype=np.float32)
+    q = np.asarray(query_vec, dtype=np.float32)
+    dist = ((exact - q) ** 2).sum(axis=1)
+    order = np.argsort(dist)[:k]
+    return [
+        Document(page_content=got["documents"][i], metadata=got["metadatas"][i] or {})
+        for i in order
+    ]
+
+
+def quantized_loader(db_dir=DB_DIR):
+    """
+    Retourne une fonction donnant (index int8, index des sources), rechargés
+    seulement quand l'index quantifié est reconstruit.
+    """
+    state = {"mtime": None, "index": None, "sources": None}
+
+    def get():
+        ids_path = quant_dir(db_dir) / "ids.json"
+        mtime = ids_path.stat().st_mtime if ids_path.exists() else None
+        if mtime != state["mtime"]:
+            state["mtime"] = mtime
+            state["index"] = Int8Index.load(db_dir) if mtime else None
+            state["sources"] = load_source_index(db_dir)
+        return state["index"], state["sources"]
+    return get
+
+
+def doc_collection_loader(db_dir=DB_DIR):
+    """
+    Retourne une fonction donnant (collection des documents ou None, nombre
+    de documents), rouverte seulement quand l'index est reconstruit
+    (source_index.json est écrit en dernier par build_index).
+    """
+    state = {"mtime": None, "col": None, "count": 0, "loaded": False}
+
+    def get():
+        path = source_index_path(db_dir)
+        mtime = path.stat().st_mtime if path.exists() else None
+        if not state["loaded"] or mtime != state["mtime"]:
+            state["mtime"] = mtime
+            state["loaded"] = True
+            state["col"] = open_doc_collection(db_dir)
+            state["count"] = state["col"].count() if state["col"] is not None else 0
+        return state["col"], state["count"]
+    return get
+
+
+def make_retrieve_fn(vectordb, k=3, doc_index=None, mode=RETRIEVAL_MODE, n_docs=STAGE1_DOCS,
+                     quantized=None):
+    """
+    Fonction de récupération pour la chaîne : entrée {"question", "sources"?,
+    "query_vec"? (embedding déjà calculé de la question)}, recherche
+    limitée aux sources demandées si présentes, en deux temps si
+    un index de documents est disponible (voir RETRIEVAL_MODE). L'index int8
+    (`quantized` : voir quantized_loader), s'il existe, remplace Chroma pour
+    la recherche des chunks, en deux temps (second niveau) comme à plat.
+    Index de documents (`doc_index` : voir doc_collection_loader) et mode
+    sont réévalués à chaque requête : un index construit ou reconstruit
+    depuis l'app est pris en compte sans redémarrage.
+    """
+    def retrieve(inputs):
+        doc_col, n_indexed = doc_index() if doc_index else (None, 0)
+        two_stage = doc_col is not None and (
+            mode == "two_stage" or (mode == "auto" and n_indexed >= TWO_STAGE_MIN_DOCS)
+        )
+        query_vec = inputs.get("query_vec")
+        if query_vec is None:
+            with profile_stage("query_embedding"):
+                query_vec = vectordb.embeddings.embed_query(inputs["question"])
+        sources = inputs.get("sources")
+        where = source_filter(sources)
+        with profile_stage("retrieval"):
+            qindex, src_index = quantized() if quantized else (None, None)
+            if two_stage:
+                return search_two_stage(vectordb, doc_col, query_vec, k=k, n_docs=n_docs,
+                                        sources=sources, qindex=qindex, src_index=src_index)
+            if qindex is not None:
+                allowed = chunk_ids_for(src_index, sources) if sources else None
+                return search_quantized(vectordb, qindex, query_vec, k=k, allowed_ids=allowed)
+            return search_flat(vectordb, query_vec, k=k, where=where)
+    return retrieve
 
 # ===============================
 # 🔗 CHAÎNE PRINCIPALE RAG
 # ===============================
-def make_chain(db_dir=DB_DIR):
+def format_source(metadata):
+    """Référence lisible d'un chunk : fichier (+ page pour les PDF)."""
+    src = metadata.get("source", "source inconnue")
+    page = metadata.get("page")
+    # PyPDFLoader numérote les pages à partir de 0
+    ref = f"{src} p.{int(page) + 1}" if page is not None else src
+    # Chunk canonique regroupant des quasi-doublons (voir dedup.py)
+    if metadata.get("duplicates", 1) > 1:
+        ref += f" (+{metadata['duplicates'] - 1} versions)"
+    return ref
+
+
+def chunk_references(metadata):
+    """Toutes les références {source, page} d'un chunk, doublons fusionnés compris."""
+    if metadata.get("all_sources"):
+        try:
+            return json.loads(metadata["all_sources"])
+        except ValueError:
+            pass
+    return [{"source": metadata.get("source"), "page": metadata.get("page")}]
+
+
+def make_chain(db_dir=DB_DIR, with_sources=False):
     """
     Construit la chaîne RAG complète :
     1. Récupération du contexte via embeddings.
     2. Génération de réponse avec modèle Ollama (local).
+
+    Entrée : {"question": ..., "sources": [...] (optionnel),
+    "history": [...], "session_id": ..., "turn": ... (optionnels)}.
+    Avec un historique, une question de suivi est d'abord reformulée en
+    requête autonome (voir query_rewriter.py), utilisée pour la seule
+    recherche : le prompt de génération reçoit la question d'origine.
+    Sortie : la réponse (str), ou si with_sources=True un dict
+    {"answer", "docs", "question", "search_query"}.
     """
-    retriever = make_retriever(db_dir=db_dir, k=3)
+    # Préchargement des modèles (embeddings + chat) en arrière-plan,
+    # puis heartbeat pour les garder en mémoire (voir model_warmup.py)
+    start_warmup()
+
+    vectordb = make_vectorstore(db_dir)
+    retrieve = make_retrieve_fn(
+        vectordb, k=3,
+        doc_index=doc_collection_loader(db_dir),
+        quantized=quantized_loader(db_dir) if USE_QUANTIZED else None,
+    )
+    rewriter = QueryRewriter()
+
+    def retrieve_with_history(inputs):
+        # Reformulation (si question de suivi) menée en parallèle de l'embedding
+        search_query, query_vec = rewriter.resolve(inputs, vectordb.embeddings.embed_query)
+        docs = retrieve({**inputs, "question": search_query, "query_vec": query_vec})
+        return {"docs": docs, "question": inputs["question"], "search_query": search_query}
     prompt = ChatPromptTemplate.from_template(SYSTEM_PROMPT)
 
-    # Sélection du modèle selon ce qui est dispo
-    # (llama3.2:1b recommandé, sinon phi3:mini)
-    try:
-        llm = ChatOllama(model="llama3.2:1b", temperature=0.2)
-    except Exception:
-        llm = ChatOllama(model="phi3:mini", temperature=0.2)
+    # Routage entre llama3.2:1b et phi3:mini selon la charge et la taille
+    # du prompt, avec fallback sur erreur / timeout (voir model_router.py)
+    llm = get_router().as_runnable()
 
     def format_docs(docs):
         out = []
         for d in docs:
-            meta = d.metadata.get("source", "source inconnue")
-            out.append(f"[{meta}] {d.page_content}")
+            out.append(f"[{format_source(d.metadata)}] {d.page_content}")
         return "\n\n".join(out)
 
-    chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
+    answer = (
+        {"context": itemgetter("docs") | RunnableLambda(format_docs),
+         "question": itemgetter("question")}
         | prompt
         | llm
         | StrOutputParser()
     )
+    chain = (
+        RunnableLambda(retrieve_with_history)
+        | RunnablePassthrough.assign(answer=answer)
+    )
 
+    if not with_sources:
+        return chain | itemgetter("answer")
     return chain
 
 # ===============================
@@ -77,15 +329,18 @@ def make_chain(db_dir=DB_DIR):
 # ===============================
 def get_index_stats(db_dir="chroma"):
     """
-    Retourne le nombre de collections et de chunks indexés dans Chroma.
+    Retourne le nombre de collections, de chunks et de documents indexés.
     """
     import chromadb
     client = chromadb.PersistentClient(db_dir)
     collections = client.list_collections()
     total_chunks = 0
     for col in collections:
+        if col.name == DOC_COLLECTION:
+            continue
         try:
-            total_chunks += len(col.get()['ids'])
+            total_chunks += col.count()
         except Exception:
             pass
-    return {"collections": len(collections), "chunks": total_chunks}
+    documents = len(load_source_index(db_dir)["sources"])
+    return {"collections": len(collections), "chunks": total_chunks, "documents": documents}
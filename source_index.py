@@ -0,0 +1,102 @@
+# source_index.py
+"""
+Index précalculé source → chunks, écrit à côté de l'index Chroma.
+
+Permet, sans interroger Chroma :
+- de lister les documents indexés (sélecteur de documents de l'app) ;
+- de connaître les IDs des chunks d'un document (filtrage, nettoyage) ;
+- de compter les chunks (statistiques).
+"""
+import hashlib
+import json
+from pathlib import Path
+
+SOURCE_INDEX_FILE = "source_index.json"
+# Préfixe des métadonnées booléennes « ce chunk appartient au document X »
+# (un chunk fusionné par la déduplication appartient à plusieurs documents)
+DOC_KEY_PREFIX = "in_doc_"
+
+
+def doc_id_for(source: str) -> str:
+    """Identifiant stable d'un document, dérivé de son chemin."""
+    norm = Path(source).as_posix()
+    return hashlib.sha1(norm.encode("utf-8")).hexdigest()[:16]
+
+
+def doc_key(doc_id: str) -> str:
+    """Clé de métadonnée marquant l'appartenance d'un chunk à un document."""
+    return f"{DOC_KEY_PREFIX}{doc_id}"
+
+
+def doc_filter(doc_ids):
+    """Filtre Chroma (where) : chunks appartenant à l'un des documents."""
+    doc_ids = list(dict.fromkeys(doc_ids))
+    if not doc_ids:
+        return None
+    if len(doc_ids) == 1:
+        return {doc_key(doc_ids[0]): True}
+    return {"$or": [{doc_key(d): True} for d in doc_ids]}
+
+
+def source_index_path(db_dir) -> Path:
+    return Path(db_dir) / SOURCE_INDEX_FILE
+
+
+def load_source_index(db_dir) -> dict:
+    """Retourne {"built_at": ..., "sources": {source: {...}}} (vide si absent)."""
+    path = source_index_path(db_dir)
+    if not path.exists():
+        return {"built_at": None, "sources": {}}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {"built_at": None, "sources": {}}
+
+
+def save_source_index(db_dir, index: dict):
+    path = source_index_path(db_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(index, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def build_source_index(chunks, built_at: str, chunk_ids=None) -> dict:
+    """
+    Construit l'index à partir des chunks annotés (metadata doc_id / chunk_id).
+    `chunk_ids` : ID effectivement indexé pour chaque chunk (après
+    déduplication, celui du chunk canonique) ; par défaut metadata["chunk_id"].
+    """
+    sources = {}
+    for i, c in enumerate(chunks):
+        meta = c.metadata
+        cid = chunk_ids[i] if chunk_ids is not None else meta["chunk_id"]
+        entry = sources.setdefault(meta["source"], {
+            "doc_id": meta["doc_id"],
+            "file_type": meta.get("file_type", ""),
+            "chunk_ids": [],
+            "pages": set(),
+        })
+        entry["chunk_ids"].append(cid)
+        if "page" in meta:
+            entry["pages"].add(meta["page"])
+    for entry in sources.values():
+        entry["pages"] = len(entry["pages"])
+        # Plusieurs chunks d'un document peuvent partager le même canonique
+        entry["chunk_ids"] = list(dict.fromkeys(entry["chunk_ids"]))
+    return {"built_at": built_at, "sources": sources}
+
+
+def chunk_ids_for(index: dict, sources) -> list:
+    """IDs des chunks appartenant aux sources données."""
+    ids = []
+    for src in sources:
+        ids.extend(index["sources"].get(src, {}).get("chunk_ids", []))
+    # Un chunk fusionné peut appartenir à plusieurs des sources demandées
+    return list(dict.fromkeys(ids))
+
+
+def chunk_ids_for_docs(index: dict, doc_ids) -> list:
+    """IDs des chunks appartenant aux documents donnés (par doc_id)."""
+    wanted = set(doc_ids)
+    return chunk_ids_for(
+        index, [src for src, e in index["sources"].items() if e.get("doc_id") in wanted]
+    )